@@ -0,0 +1,119 @@
+"""
+End-to-end request latency against the in-memory database backend: the
+full app (middlewares, auth, rate limiting, audit) with no mongod.
+
+    python -m benchmarks.api_memory
+    python -m benchmarks.api_memory --iterations 500
+
+Runs signup, login, catalog writes, clinical writes and the main read
+paths, failing loudly if any request returns an unexpected status.
+"""
+import os
+
+os.environ["DATABASE_BACKEND"] = "memory"
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# One client drives everything; keep admission control out of the numbers.
+os.environ.setdefault("RATE_LIMITS", ",".join(
+    f"{role}=1e9:1e9" for role in ("anonymous", "patient", "receptionist", "doctor", "admin")
+))
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlencode
+
+from src.app import app, shutdown, startup
+from src.auth import hash_password
+from src.database import collections
+
+
+async def call(method: str, path: str, token: str = None, body=None, form: dict = None, query: dict = None):
+    headers = [(b"host", b"bench")]
+    payload = b""
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    if body is not None:
+        payload = json.dumps(body).encode()
+        headers.append((b"content-type", b"application/json"))
+    if form is not None:
+        payload = urlencode(form).encode()
+        headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": urlencode(query or {}).encode(), "headers": headers,
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = sent[0]["status"]
+    data = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return status, json.loads(data) if data else None
+
+
+async def expect(status: int, method: str, path: str, **kwargs):
+    got, data = await call(method, path, **kwargs)
+    if got != status:
+        raise SystemExit(f"{method} {path}: expected {status}, got {got}: {data}")
+    return data
+
+
+async def login(username: str, password: str) -> str:
+    data = await expect(200, "POST", "/login", form={"username": username, "password": password})
+    return data["access_token"]
+
+
+async def setup():
+    await startup()
+    await collections["persons"].insert_one({
+        "uuid": "admin", "username": "admin", "password": hash_password("admin"), "role": "admin",
+    })
+    admin = await login("admin", "admin")
+    await expect(200, "POST", "/signup", token=admin,
+                 body={"username": "doc", "password": "doc", "role": "doctor", "name": "Dr. Bench"})
+    patient = await expect(200, "POST", "/signup",
+                           body={"username": "pat", "password": "pat", "role": "patient", "name": "Pat Bench"})
+    doctor = await login("doc", "doc")
+    medicine = await expect(200, "POST", "/medicine", token=doctor, body={"name": "Paracetamol", "strength": "500mg"})
+    doctor_uuid = (await collections["persons"].find_one({"username": "doc"}))["uuid"]
+    return admin, doctor, doctor_uuid, patient["uuid"], medicine["data"]["uuid"]
+
+
+async def scenario(admin: str, doctor: str, doctor_uuid: str, patient_uuid: str, medicine_uuid: str):
+    prescribed = await expect(200, "POST", f"/doctor/prescribe-medicine/{patient_uuid}", token=doctor,
+                              body={"medicine_id": medicine_uuid, "dosage": "1x daily"})
+    await expect(200, "GET", f"/patients/{patient_uuid}", token=doctor)
+    await expect(200, "GET", "/patients", token=doctor, query={"limit": 20})
+    await expect(200, "GET", "/medicine", token=admin, query={"limit": 20})
+    await expect(200, "GET", f"/doctors/{doctor_uuid}/patients", token=admin)
+    await expect(200, "DELETE", f"/doctor/prescribe-medicine/{prescribed['data']['uuid']}", token=doctor)
+    await expect(200, "POST", f"/admin/restore/medication/{prescribed['data']['uuid']}", token=admin)
+
+
+async def main(iterations: int):
+    users = await setup()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await scenario(*users)
+        timings.append(time.perf_counter() - started)
+    await shutdown()
+    per_request = statistics.median(timings) / 7 * 1000
+    print(f"{iterations} scenarios (7 requests each): median {statistics.median(timings) * 1000:.2f} ms/scenario, "
+          f"{per_request:.2f} ms/request")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API latency on the in-memory backend.")
+    parser.add_argument("--iterations", type=int, default=200)
+    asyncio.run(main(parser.parse_args().iterations))
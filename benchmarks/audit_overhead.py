@@ -0,0 +1,26 @@
+"""
+Per-request cost of recording an audit event (the only part that runs on
+the request path; flushing happens in the background).
+
+    python -m benchmarks.audit_overhead
+"""
+import timeit
+
+from src.audit import AuditLog
+from src.schema import Person, RoleEnum
+
+N = 200_000
+
+
+def main():
+    log = AuditLog(batch_size=N + 1, max_buffer=N + 1)
+    actor = Person(uuid="doctor-uuid", role=RoleEnum.DOCTOR)
+    seconds = timeit.timeit(
+        lambda: log.record(actor, "read", "patient_chart", "patient-uuid", "patient-uuid"),
+        number=N,
+    )
+    print(f"AuditLog.record: {seconds / N * 1e6:.2f} us/event over {N} events")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Memory footprint and lookup latency of the reception patient index,
+extrapolated to one million patients.
+
+    python -m benchmarks.patient_index
+"""
+import random
+import timeit
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+
+from src.patient_index import PatientIndex
+
+N = 100_000
+
+
+def patient(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "uuid": str(uuid.uuid4()),
+        "username": f"patient{i}",
+        "name": f"Patient Number {i}",
+        "gender": random.choice(["male", "female"]),
+        "DOB": datetime(1950 + i % 60, 1 + i % 12, 1 + i % 28),
+        "contact_details": {"email": f"patient{i}@example.com", "phone_num": f"+92300{i:07d}", "address": None},
+        "blood_group": random.choice(["A+", "B+", "O+", "AB-"]),
+        "emergency_contact": None,
+        "role": "patient",
+    }
+
+
+def main():
+    index = PatientIndex()
+    # Documents are created inside the trace and dropped afterwards, so
+    # only what the index keeps alive is counted.
+    tracemalloc.start()
+    for i in range(N):
+        index.put(patient(i))
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    uuids = [index.get(username=f"patient{i}").uuid for i in random.sample(range(N), 1000)]
+
+    print(f"traced: {traced / N:.0f} bytes/patient, {traced / N * 1e6 / 2 ** 20:.0f} MB per million")
+    print(f"estimate: {index.report()}")
+
+    exact = timeit.timeit(lambda: [index.get(uuid=u) for u in uuids], number=100) / 100_000
+    prefix = timeit.timeit(lambda: index.search("patient12", 20), number=10_000) / 10_000
+    print(f"exact lookup: {exact * 1e6:.2f} us, prefix search (20 hits): {prefix * 1e6:.2f} us")
+
+    signups = [patient(N + i) for i in range(10_000)]
+    started = timeit.default_timer()
+    for doc in signups:
+        index.put(doc)
+    print(f"insert at {N} patients: {(timeit.default_timer() - started) / len(signups) * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Cold start: time to import src.app and latency of the first requests,
+each measured in a fresh interpreter (median of --runs).
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10
+
+Requests go straight to the ASGI app on the in-memory database backend,
+so no MongoDB is needed. The probe seeds an admin and a few medicines,
+then times an authenticated /medicine/expiring, which is serialized
+through the APIResponse[List[Medicine]] response model. For a
+per-module breakdown of the import use
+
+    python -X importtime -c "import src.app"
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r"""
+import asyncio, json, time
+from datetime import datetime, timedelta
+
+started = time.perf_counter()
+from src.app import app
+imported = time.perf_counter()
+
+from src.auth import create_session
+from src.database import collections
+from src.expiry import expiry_index
+from src.schema import Medicine, Person, RoleEnum
+
+
+async def seed():
+    admin = Person(username="admin", password="unused", role=RoleEnum.ADMIN)
+    await collections["persons"].insert_one(admin.dict(by_alias=True))
+    await collections["medicine"].insert_many([
+        Medicine(name=f"Medicine {i}", expiry_date=datetime.utcnow() + timedelta(days=i)).dict(by_alias=True)
+        for i in range(20)
+    ])
+    await expiry_index.load()
+    return (await create_session(admin))["access_token"]
+
+
+async def request(path, query, token):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query,
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    began = time.perf_counter()
+    await app(scope, receive, send)
+    elapsed = time.perf_counter() - began
+    if sent[0]["status"] != 200:
+        raise SystemExit(f"GET {path}: expected 200, got {sent[0]['status']}")
+    return elapsed
+
+
+async def main():
+    token = await seed()
+    first = await request("/medicine/expiring", b"within=30", token)
+    second = await request("/medicine/expiring", b"within=30", token)
+    return first, second
+
+
+first, second = asyncio.run(main())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": first * 1000,
+    "warm_request_ms": second * 1000,
+}))
+"""
+
+
+def probe() -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": root, "DATABASE_BACKEND": "memory",
+           "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark")}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=root, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    runs = [probe() for _ in range(parser.parse_args().runs)]
+    for key in runs[0]:
+        print(f"{key}: {statistics.median(run[key] for run in runs):.1f}")
+
+
+if __name__ == "__main__":
+    main()
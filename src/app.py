@@ -1,13 +1,60 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from .auth import *
 import uuid
 from .schema import *
-from .database import collections
+from .database import client, collections
+from . import archive, audit, auth, caseload, events, idempotency, importer, profiler, ratelimit, softdelete, versions
+from .revocation import revocations
+from .expiry import expiry_index
+from .patient_index import patient_index
+from .softdelete import live
+from .routers import build_entity_router, pagination
+from .compression import CompressionMiddleware
 from fastapi import Body
-from datetime import datetime
-from typing import Type
-app = FastAPI(title="Hospital Management API")
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+ImportReportResponse = APIResponse[importer.ImportReport]
+CaseloadResponse = APIResponse[List[caseload.CaseloadEntry]]
+
+app = FastAPI(
+    title="Hospital Management API",
+    dependencies=[*profiler.route_dependencies(), Depends(ratelimit.admit)],
+)
+app.add_middleware(idempotency.IdempotencyMiddleware)
+# Added last so it wraps idempotency replays as well.
+app.add_middleware(CompressionMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    await idempotency.ensure_indexes()
+    await caseload.ensure_indexes()
+    await archive.ensure_indexes()
+    await auth.ensure_indexes()
+    await softdelete.ensure_indexes()
+    await versions.start()
+    await revocations.start()
+    profiler.attach(client)
+    await audit.audit_log.start()
+    await patient_index.start()
+    await expiry_index.start()
+    await softdelete.compactor.start()
+    await ratelimit.limiter.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    importer.shutdown_pool()
+    await audit.audit_log.stop()
+    await revocations.stop()
+    await patient_index.stop()
+    await expiry_index.stop()
+    await softdelete.compactor.stop()
+    await ratelimit.limiter.stop()
+    await versions.stop()
+
 
 @app.post("/signup")
 async def signup(new_user: Person,current_user: Optional[Person] = Depends(get_current_user)):
@@ -19,6 +66,8 @@ async def signup(new_user: Person,current_user: Optional[Person] = Depends(get_c
         else:
             raise HTTPException(status_code=403, detail="Not authorized to create patient profiles")
 
+        # Not filtered with live(): soft-deleted accounts keep their
+        # username until purged, so restoring one can never collide.
         existing = await collections["persons"].find_one({"username": new_user.username})
         if existing:
             raise HTTPException(status_code=400, detail="Username already exists")
@@ -28,11 +77,19 @@ async def signup(new_user: Person,current_user: Optional[Person] = Depends(get_c
         user_dict = new_user.dict(by_alias=True)
         user_dict["uuid"] = patient_uuid
         user_dict["password"] = hash_password(new_user.password)
+        # Lets other workers' patient indexes pick up the change.
+        user_dict["updated_at"] = datetime.utcnow()
 
-        await collections["persons"].insert_one(user_dict)
+        try:
+            await collections["persons"].insert_one(user_dict)
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Username already exists")
+        patient_index.put(user_dict)
 
         medical_history = MedicalHistory(patient_id=patient_uuid)
         await collections["medical_history"].insert_one(medical_history.dict(by_alias=True))
+        versions.bump("persons", "medical_history")
+        audit.record(current_user, "create", "persons", patient_uuid, patient_uuid)
 
         return {"message": "Patient profile created successfully", "uuid": patient_uuid}
 
@@ -51,84 +108,144 @@ async def signup(new_user: Person,current_user: Optional[Person] = Depends(get_c
     user_dict["uuid"] = user_uuid
     user_dict["password"] = hash_password(new_user.password)
 
-    await collections["persons"].insert_one(user_dict)
+    try:
+        await collections["persons"].insert_one(user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    versions.bump("persons")
+    audit.record(current_user, "create", "persons", user_uuid)
     return {"message": f"{new_user.role.value} profile created successfully", "uuid": user_uuid}
 
+@app.post("/import/{entity}", response_model=ImportReportResponse)
+async def import_records(
+    entity: str,
+    request: Request,
+    format: Optional[str] = Query(None, regex="^(csv|ndjson)$"),
+    current_user: Optional[Person] = Depends(get_current_user)
+):
+    """
+    Streams a CSV or NDJSON request body into patients or a catalog.
+    The body is parsed and inserted in chunks as it arrives.
+    """
+    if entity not in importer.IMPORTABLE:
+        raise HTTPException(status_code=404, detail=f"Cannot import {entity}")
+    allowed = [RoleEnum.ADMIN, RoleEnum.RECEPTIONIST] if entity == "patients" else [RoleEnum.ADMIN]
+    if not current_user or current_user.role not in allowed:
+        raise HTTPException(status_code=403, detail=f"Not authorized to import {entity}")
+
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv"
+
+    report = await importer.import_stream(entity, request.stream(), format)
+    audit.record(current_user, "import", entity)
+    return ImportReportResponse(
+        code=201,
+        message=f"Imported {report.inserted} of {report.rows} rows",
+        data=report
+    )
+
 @app.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    access_token = create_access_token(
-        data={
-            "sub": user.username,
-            "role": user.role,
-            "uuid": user.uuid
-        }
-    )
+    tokens = await create_session(user)
+    return {
+        **tokens,
+        "role": user.role,
+        "uuid": user.uuid
+    }
+
+
+@app.post("/token/refresh")
+async def refresh_token(refresh_token: str = Body(..., embed=True)):
+    user, tokens = await refresh_session(refresh_token)
     return {
-        "access_token": access_token,
-        "token_type": "bearer",
+        **tokens,
         "role": user.role,
         "uuid": user.uuid
     }
 
 
-@app.get("/patients", response_model=APIResponse[List[Person]])
-async def list_patients(current_user: Person = Depends(get_current_user)):
+@app.post("/logout", response_model=EmptyResponse)
+async def logout(claims: Optional[dict] = Depends(get_token_claims)):
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    await revoke_access_token(claims)
+    return EmptyResponse(code=200, message="Logged out successfully", data=None)
+
+
+@app.get("/patients", response_model=PersonListResponse)
+async def list_patients(
+    request: Request,
+    response: Response,
+    page: tuple = Depends(pagination),
+    current_user: Person = Depends(get_current_user)
+):
     if current_user.role not in [RoleEnum.DOCTOR, RoleEnum.ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
+    audit.record(current_user, "list", "persons")
+    versions.check_not_modified(request, response, "persons", variant=current_user.role)
 
-    patients_cursor = collections["persons"].find({"role": RoleEnum.PATIENT})
+    skip, limit = page
+    patients_cursor = collections["persons"].find(live({"role": RoleEnum.PATIENT})).sort("_id", 1).skip(skip).limit(limit)
     patients: List[Person] = []
     async for doc in patients_cursor:
         patients.append(Person(**doc)) 
 
-    return APIResponse[List[Person]](
+    return PersonListResponse(
         code=200,
         message="Patients retrieved successfully",
         data=patients
     )
-@app.get("/receptionists", response_model=APIResponse[List[Person]])
-async def list_receptionists(current_user: Person = Depends(get_current_user)):
+@app.get("/receptionists", response_model=PersonListResponse)
+async def list_receptionists(
+    request: Request,
+    response: Response,
+    page: tuple = Depends(pagination),
+    current_user: Person = Depends(get_current_user)
+):
     if current_user.role not in [RoleEnum.DOCTOR, RoleEnum.ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
+    versions.check_not_modified(request, response, "persons", variant=current_user.role)
 
-    receptionists_cursor = collections["persons"].find({"role": RoleEnum.RECEPTIONIST})
+    skip, limit = page
+    receptionists_cursor = collections["persons"].find(live({"role": RoleEnum.RECEPTIONIST})).sort("_id", 1).skip(skip).limit(limit)
     receptionists: List[Person] = []
     async for doc in receptionists_cursor:
         receptionists.append(Person(**doc)) 
 
-    return APIResponse[List[Person]](
+    return PersonListResponse(
         code=200,
         message="Receptionists retrieved successfully",
         data=receptionists
     )
 
-@app.get("/receptionist/{uuid}", response_model=APIResponse[Person])
+@app.get("/receptionist/{uuid}", response_model=PersonResponse)
 async def get_receptionist(uuid: str, current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.ADMIN and current_user.uuid != uuid:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    doc = await collections["persons"].find_one({"uuid": uuid, "role": RoleEnum.RECEPTIONIST})
+    doc = await collections["persons"].find_one(live({"uuid": uuid, "role": RoleEnum.RECEPTIONIST}))
     if not doc:
         raise HTTPException(status_code=404, detail="Receptionist not found")
 
     receptionist = Person(**doc)
-    return APIResponse[Person](
+    return PersonResponse(
         code=200,
         message="Receptionist retrieved successfully",
         data=receptionist
     )
 
-@app.put("/persons/{uuid}", response_model=APIResponse[Person])
+@app.put("/persons/{uuid}", response_model=PersonResponse)
 async def update_person(
     uuid: str,
     updated_data: Person = Body(...),
     current_user: Person = Depends(get_current_user)
 ):
-    person_doc = await collections["persons"].find_one({"uuid": uuid})
+    person_doc = await collections["persons"].find_one(live({"uuid": uuid}))
     if not person_doc:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -148,48 +265,86 @@ async def update_person(
 
     # Only update fields provided
     update_dict = {k: v for k, v in updated_data.dict(exclude_unset=True).items() if v is not None}
-
-    await collections["persons"].update_one(
-        {"uuid": uuid},
-        {"$set": update_dict}
-    )
-
-    updated_person_doc = await collections["persons"].find_one({"uuid": uuid})
-    return APIResponse[Person](
+    update_dict["updated_at"] = datetime.utcnow()
+
+    try:
+        await collections["persons"].update_one(
+            live({"uuid": uuid}),
+            {"$set": update_dict}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    # Tokens carry username and role; drop them when those (or the password) change.
+    if any(k in update_dict and update_dict[k] != person_doc.get(k) for k in ("username", "role", "password")):
+        await revoke_user(uuid)
+    versions.bump("persons")
+    patient_id = uuid if person_doc.get("role") == RoleEnum.PATIENT else None
+    audit.record(current_user, "update", "persons", uuid, patient_id)
+
+    updated_person_doc = await collections["persons"].find_one(live({"uuid": uuid}))
+    if updated_person_doc.get("role") == RoleEnum.PATIENT:
+        patient_index.put(updated_person_doc)
+    else:
+        patient_index.remove(uuid)
+    return PersonResponse(
         code=200,
         message="User updated successfully",
         data=Person(**updated_person_doc)
     )
 
 
-@app.delete("/persons/{uuid}", response_model=APIResponse[None])
+@app.delete("/persons/{uuid}", response_model=EmptyResponse)
 async def delete_person(uuid: str, current_user: Person = Depends(get_current_user)):
-    person_doc = await collections["persons"].find_one({"uuid": uuid})
-    if not person_doc:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     if current_user.role != RoleEnum.ADMIN and current_user.uuid != uuid:
         raise HTTPException(status_code=403, detail="You can only delete your own account")
 
+    # One timestamp for the whole cascade so a restore brings back exactly
+    # what this delete removed.
+    deleted_at = datetime.utcnow()
+    person_doc = await softdelete.delete_one("persons", {"uuid": uuid}, deleted_at)
+    if not person_doc:
+        raise HTTPException(status_code=404, detail="User not found")
+
     if person_doc["role"] == RoleEnum.PATIENT:
-        medical_history_doc = await collections["medical_history"].find_one({"patient_id": uuid})
+        medical_history_doc = await softdelete.delete_one("medical_history", {"patient_id": uuid}, deleted_at)
         if medical_history_doc:
             medical_history_id = medical_history_doc["uuid"]
+            for name in softdelete.CHART_COLLECTIONS:
+                await softdelete.delete_many(name, {"medical_history_id": medical_history_id}, deleted_at)
+            if not softdelete.SOFT_DELETE:
+                await softdelete.after_purge("medical_history", [medical_history_doc])
+            events.hub.publish(medical_history_id, "chart.deleted")
+            versions.bump("medication", "past_surgery", "condition_diagnosis", "allergy_diagnosis", "medical_history")
+    if not softdelete.SOFT_DELETE:
+        await softdelete.after_purge("persons", [person_doc])
+
+    patient_index.remove(uuid)
+    await revoke_user(uuid)
+    versions.bump("persons")
+    patient_id = uuid if person_doc["role"] == RoleEnum.PATIENT else None
+    audit.record(current_user, "delete", "persons", uuid, patient_id)
+    message = "User deleted successfully" if current_user.role == RoleEnum.ADMIN else "Your account has been deleted successfully"
+    return EmptyResponse(code=200, message=message, data=None)
 
-            await collections["medication"].delete_many({"medical_history_id": medical_history_id})
-            await collections["past_surgery"].delete_many({"medical_history_id": medical_history_id})
-            await collections["condition_diagnosis"].delete_many({"medical_history_id": medical_history_id})
-            await collections["allergy_diagnosis"].delete_many({"medical_history_id": medical_history_id})
-            await collections["medical_history"].delete_one({"uuid": medical_history_id})
 
-    await collections["persons"].delete_one({"uuid": uuid})
-    message = "User deleted successfully" if current_user.role == RoleEnum.ADMIN else "Your account has been deleted successfully"
-    return APIResponse[None](code=200, message=message, data=None)
+async def load_clinical_records(name: str, model, medical_history_id: str,
+                                since: Optional[datetime], include_archived: bool):
+    query = live({"medical_history_id": medical_history_id, **archive.since_filter(name, since)})
+    docs = [doc async for doc in collections[name].find(query)]
+    if include_archived:
+        hot = {doc["uuid"] for doc in docs}
+        archived = await archive.load_archived(name, medical_history_id, since)
+        docs = [row for row in archived if row.get("uuid") not in hot] + docs
+    return [model(**doc) for doc in docs]
 
 
-@app.get("/patients/{uuid}", response_model=APIResponse[dict])
+@app.get("/patients/{uuid}", response_model=DictResponse)
 async def get_patient_full(
     uuid: str,
+    request: Request,
+    response: Response,
+    since: Optional[datetime] = Query(None, description="Only records dated on or after this time"),
+    include_archived: bool = Query(False, description="Also return archived records"),
     current_user: Person = Depends(get_current_user)
 ):
     if current_user.role == RoleEnum.PATIENT:
@@ -197,30 +352,33 @@ async def get_patient_full(
             raise HTTPException(status_code=403, detail="Not authorized to view other patients")
     elif current_user.role not in [RoleEnum.DOCTOR, RoleEnum.ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
+    audit.record(current_user, "read", "patient_chart", uuid, uuid)
+    versions.check_not_modified(
+        request, response,
+        "persons", "medical_history", "medication", "past_surgery", "condition_diagnosis", "allergy_diagnosis",
+    )
 
-    patient_doc = await collections["persons"].find_one({"uuid": uuid, "role": RoleEnum.PATIENT})
+    patient_doc = await collections["persons"].find_one(live({"uuid": uuid, "role": RoleEnum.PATIENT}))
     if not patient_doc:
         raise HTTPException(status_code=404, detail="Patient not found")
 
     patient = Person(**patient_doc)
+    since = archive.naive_utc(since)
 
-    medical_history_doc = await collections["medical_history"].find_one({"patient_id": uuid})
+    medical_history_doc = await collections["medical_history"].find_one(live({"patient_id": uuid}))
     if not medical_history_doc:
         medical_history_data = {}
     else:
         medical_history_id = medical_history_doc["uuid"]
 
-        medications_cursor = collections["medication"].find({"medical_history_id": medical_history_id})
-        medications = [Medication(**m) async for m in medications_cursor]
-
-        surgeries_cursor = collections["past_surgery"].find({"medical_history_id": medical_history_id})
-        past_surgeries = [PastSurgery(**s) async for s in surgeries_cursor]
-
-        conditions_cursor = collections["condition_diagnosis"].find({"medical_history_id": medical_history_id})
-        condition_diagnoses = [ConditionDiagnosis(**c) async for c in conditions_cursor]
-
-        allergies_cursor = collections["allergy_diagnosis"].find({"medical_history_id": medical_history_id})
-        allergy_diagnoses = [AllergyDiagnosis(**a) async for a in allergies_cursor]
+        medications = await load_clinical_records(
+            "medication", Medication, medical_history_id, since, include_archived)
+        past_surgeries = await load_clinical_records(
+            "past_surgery", PastSurgery, medical_history_id, since, include_archived)
+        condition_diagnoses = await load_clinical_records(
+            "condition_diagnosis", ConditionDiagnosis, medical_history_id, since, include_archived)
+        allergy_diagnoses = await load_clinical_records(
+            "allergy_diagnosis", AllergyDiagnosis, medical_history_id, since, include_archived)
 
         medical_history_data = {
             "uuid": medical_history_id,
@@ -233,39 +391,77 @@ async def get_patient_full(
     result = patient.dict()
     result["medical_history"] = medical_history_data
 
-    return APIResponse[dict](
+    return DictResponse(
         code=200,
         message="Patient with medical history retrieved successfully",
         data=result
     )
 
 
+@app.get("/patients/{uuid}/events")
+async def subscribe_patient_events(
+    uuid: str,
+    request: Request,
+    current_user: Person = Depends(get_current_user)
+):
+    """
+    Server-Sent Events stream of changes to a patient's chart, replacing
+    polling of GET /patients/{uuid}.
+    """
+    if current_user.role == RoleEnum.PATIENT:
+        if current_user.uuid != uuid:
+            raise HTTPException(status_code=403, detail="Not authorized to view other patients")
+    elif current_user.role not in [RoleEnum.DOCTOR, RoleEnum.ADMIN]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    medical_history_doc = await collections["medical_history"].find_one(live({"patient_id": uuid}))
+    if not medical_history_doc:
+        raise HTTPException(status_code=404, detail="Medical history not found")
+    audit.record(current_user, "subscribe", "patient_chart", uuid, uuid)
+
+    if not events.hub.has_capacity():
+        raise HTTPException(status_code=503, detail="Too many live subscriptions", headers={"Retry-After": "30"})
+
+    return StreamingResponse(
+        events.stream(medical_history_doc["uuid"], events.hub, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 
-@app.get("/doctors", response_model=APIResponse[List[Person]])
-async def list_doctors(current_user: Person = Depends(get_current_user)):
+@app.get("/doctors", response_model=PersonListResponse)
+async def list_doctors(
+    request: Request,
+    response: Response,
+    page: tuple = Depends(pagination),
+    current_user: Person = Depends(get_current_user)
+):
     if current_user.role not in [RoleEnum.RECEPTIONIST, RoleEnum.ADMIN]:
         raise HTTPException(status_code=403, detail="Not authorized")
+    versions.check_not_modified(request, response, "persons", variant=current_user.role)
 
-    doctors_cursor = collections["persons"].find({"role": RoleEnum.DOCTOR})
+    skip, limit = page
+    doctors_cursor = collections["persons"].find(live({"role": RoleEnum.DOCTOR})).sort("_id", 1).skip(skip).limit(limit)
     doctors: List[Person] = []
     async for doc in doctors_cursor:
         if current_user.role == RoleEnum.RECEPTIONIST:
             doc["password"] = "**************"
         doctors.append(Person(**doc))
 
-    return APIResponse[List[Person]](
+    return PersonListResponse(
         code=200,
         message="Doctors retrieved successfully",
         data=doctors
     )
 
-@app.get("/doctors/{uuid}", response_model=APIResponse[Person])
+@app.get("/doctors/{uuid}", response_model=PersonResponse)
 async def get_doctor(
     uuid: str,
     current_user: Person = Depends(get_current_user)
 ):
     doctor_doc = await collections["persons"].find_one(
-        {"uuid": uuid, "role": RoleEnum.DOCTOR}
+        live({"uuid": uuid, "role": RoleEnum.DOCTOR})
     )
     if not doctor_doc:
         raise HTTPException(status_code=404, detail="Doctor not found")
@@ -274,13 +470,107 @@ async def get_doctor(
     doctor = Person(**doctor_doc)
     if current_user.role in [RoleEnum.RECEPTIONIST, RoleEnum.PATIENT]:
         doctor.password = None  
-    return APIResponse[Person](
+    return PersonResponse(
         code=200,
         message="Doctor retrieved successfully",
         data=doctor
     )
 
-@app.get("/receive-patient", response_model=APIResponse[Person])
+@app.get("/doctors/{uuid}/patients", response_model=CaseloadResponse)
+async def list_doctor_patients(
+    uuid: str,
+    page: tuple = Depends(pagination),
+    current_user: Person = Depends(get_current_user)
+):
+    if current_user.role != RoleEnum.ADMIN and not (current_user.role == RoleEnum.DOCTOR and current_user.uuid == uuid):
+        raise HTTPException(status_code=403, detail="Doctors can only view their own patients")
+    skip, limit = page
+    entries = await caseload.patients_of(uuid, skip, limit)
+    audit.record(current_user, "list", "doctor_patients", uuid)
+    return CaseloadResponse(
+        code=200,
+        message="Patients retrieved successfully",
+        data=entries
+    )
+
+@app.post("/admin/archive", response_model=DictResponse)
+async def archive_clinical_records(
+    days: int = Query(archive.ARCHIVE_AFTER_DAYS, ge=1),
+    current_user: Person = Depends(get_current_user)
+):
+    """
+    Runs the archiver in-process so chart ETags see the change.
+    """
+    if current_user.role != RoleEnum.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can archive records")
+    moved = await archive.archive_all(days)
+    return DictResponse(code=200, message="Records archived successfully", data=moved)
+
+@app.post("/admin/restore/{entity}/{uuid}", response_model=DictResponse)
+async def restore_deleted(entity: str, uuid: str, current_user: Person = Depends(get_current_user)):
+    if current_user.role != RoleEnum.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can restore deleted records")
+    if not softdelete.SOFT_DELETE:
+        raise HTTPException(status_code=404, detail="Soft delete is disabled (set SOFT_DELETE=1)")
+    if entity not in softdelete.SOFT_DELETED:
+        raise HTTPException(status_code=404, detail=f"Unknown entity {entity}")
+
+    doc = await softdelete.restore_one(entity, {"uuid": uuid})
+    if not doc:
+        raise HTTPException(status_code=404, detail=f"No deleted {entity} with uuid {uuid}")
+    restored = {entity: 1}
+    patient_id = None
+
+    if entity == "persons" and doc.get("role") == RoleEnum.PATIENT:
+        patient_id = uuid
+        # Bring back the chart deleted together with the patient, not
+        # records deleted individually before that.
+        history = await softdelete.restore_one(
+            "medical_history", {"patient_id": uuid, "deleted_at": doc["deleted_at"]}
+        )
+        if history:
+            restored["medical_history"] = 1
+            for name in softdelete.CHART_COLLECTIONS:
+                restored[name] = await softdelete.restore_many(
+                    name, {"medical_history_id": history["uuid"], "deleted_at": doc["deleted_at"]}
+                )
+        await collections["persons"].update_one({"uuid": uuid}, {"$set": {"updated_at": datetime.utcnow()}})
+        patient_index.put(doc)
+    elif entity == "medicine":
+        expiry_index.put(doc)
+    elif entity in caseload.CLINICAL_LINKS:
+        history = await collections["medical_history"].find_one(live({"uuid": doc.get("medical_history_id")}))
+        if history:
+            patient_id = history.get("patient_id")
+            doctor_id = doc.get(caseload.CLINICAL_LINKS[entity])
+            if doctor_id:
+                await caseload.link(doctor_id, patient_id, history["uuid"], entity)
+            events.hub.publish(history["uuid"], f"{entity}.restored", {"uuid": uuid})
+
+    versions.bump(*restored)
+    audit.record(current_user, "restore", entity, uuid, patient_id)
+    return DictResponse(
+        code=200,
+        message=f"{entity} {uuid} restored",
+        data=restored
+    )
+
+@app.get("/admin/slow-queries", response_model=DictListResponse)
+async def list_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    current_user: Person = Depends(get_current_user)
+):
+    if current_user.role != RoleEnum.ADMIN:
+        raise HTTPException(status_code=403, detail="Only admins can view slow queries")
+    if profiler.listener is None:
+        raise HTTPException(status_code=404, detail="Query profiling is disabled (set MONGO_PROFILE=1)")
+    return DictListResponse(
+        code=200,
+        message="Slow queries retrieved successfully",
+        data=profiler.listener.top(limit)
+    )
+
+@app.get("/receive-patient", response_model=PersonResponse)
 async def receive_patient(username: Optional[str] = Query(None), uuid: Optional[str] = Query(None), current_user: Person = Depends(get_current_user)):
     print(current_user)
     if current_user.role not in RoleEnum.RECEPTIONIST:
@@ -289,26 +579,68 @@ async def receive_patient(username: Optional[str] = Query(None), uuid: Optional[
     if not username and not uuid:
         raise HTTPException(status_code=400, detail="Provide either username or uuid")
 
-    query = {"role": RoleEnum.PATIENT}
-    if username:
-        query["username"] = username
-    if uuid:
-        query["uuid"] = uuid
+    record = patient_index.get(uuid=uuid, username=username)
+    if record is None:
+        # Not indexed yet (index still building, or written by another
+        # worker since the last refresh): fall back to Mongo and remember it.
+        query = {"role": RoleEnum.PATIENT}
+        if username:
+            query["username"] = username
+        if uuid:
+            query["uuid"] = uuid
 
-    patient_doc = await collections["persons"].find_one(query)
-    if not patient_doc:
-        raise HTTPException(status_code=404, detail="Patient not found")
+        patient_doc = await collections["persons"].find_one(live(query), {"password": 0})
+        if not patient_doc:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        patient_index.put(patient_doc)
+        record = patient_index.get(uuid=patient_doc["uuid"])
 
-    patient_doc["password"] = None  
+    audit.record(current_user, "read", "persons", record.uuid, record.uuid)
 
-    patient = Person(**patient_doc)
+    patient = record.to_person()
 
-    return APIResponse[Person](
+    return PersonResponse(
         code=200,
         message="Patient details retrieved successfully",
         data=patient
     )
 
+@app.get("/receive-patient/search", response_model=PersonListResponse)
+async def search_patients(
+    q: str = Query(..., min_length=2, description="Prefix of username, name or phone number"),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: Person = Depends(get_current_user),
+):
+    if current_user.role != RoleEnum.RECEPTIONIST:
+        raise HTTPException(status_code=403, detail=f"{current_user.role} Not a receptionist")
+
+    records = patient_index.search(q, limit)
+    for record in records:
+        audit.record(current_user, "read", "persons", record.uuid, record.uuid)
+    return PersonListResponse(
+        code=200,
+        message="Patients retrieved successfully",
+        data=[record.to_person() for record in records]
+    )
+
+@app.get("/medicine/expiring", response_model=MedicineListResponse)
+async def expiring_medicine(
+    within: int = Query(30, ge=0, le=3650, description="Days ahead"),
+    include_expired: bool = Query(False, description="Also list medicines already past their expiry date"),
+    current_user: Person = Depends(get_current_user),
+):
+    # Registered before the medicine router so /medicine/{uuid} doesn't shadow it.
+    if current_user.role not in entity_access["medicine"]["read"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if not expiry_index.ready:
+        raise HTTPException(status_code=503, detail="Expiry index is not loaded yet", headers={"Retry-After": "30"})
+    docs = expiry_index.expiring(timedelta(days=within), include_expired=include_expired)
+    return MedicineListResponse(
+        code=200,
+        message="Expiring medicines retrieved successfully",
+        data=[Medicine(**doc) for doc in docs]
+    )
+
 entity_access = {
     "allergy": {"create": [RoleEnum.DOCTOR], "read": [RoleEnum.DOCTOR, RoleEnum.ADMIN],
                 "update": [RoleEnum.DOCTOR], "delete": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
@@ -318,152 +650,44 @@ entity_access = {
                  "update": [RoleEnum.DOCTOR], "delete": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
     "surgery": {"create": [RoleEnum.DOCTOR], "read": [RoleEnum.DOCTOR, RoleEnum.ADMIN],
                 "update": [RoleEnum.DOCTOR], "delete": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
+    "insurance": {"create": [RoleEnum.RECEPTIONIST, RoleEnum.ADMIN],
+                  "read": [RoleEnum.RECEPTIONIST, RoleEnum.DOCTOR, RoleEnum.ADMIN],
+                  "update": [RoleEnum.RECEPTIONIST, RoleEnum.ADMIN], "delete": [RoleEnum.ADMIN]},
+    # Clinical records are written only through the /doctor endpoints
+    # below (and medical histories by signup), so they get read routes only.
+    "medical_history": {"read": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
+    "medication": {"read": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
+    "past_surgery": {"read": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
+    "condition_diagnosis": {"read": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
+    "allergy_diagnosis": {"read": [RoleEnum.DOCTOR, RoleEnum.ADMIN]},
 }
 
-async def create_entity(entity_name: str, data: BaseModel, current_user: Person):
-    if current_user.role not in entity_access[entity_name]["create"]:
-        raise HTTPException(status_code=403, detail=f"Not authorized to create {entity_name}")
-    result = await collections[entity_name].insert_one(data.dict(by_alias=True))
-    created = await collections[entity_name].find_one({"_id": result.inserted_id})
-    return APIResponse(code=201, message=f"{entity_name.capitalize()} created successfully", data=data.__class__(**created))
-
-
-async def list_entities(entity_name: str, model: Type[BaseModel], current_user: Person):
-    if current_user.role not in entity_access[entity_name]["read"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    cursor = collections[entity_name].find()
-    items: List[BaseModel] = [model(**doc) async for doc in cursor]
-    return APIResponse[List[BaseModel]](code=200, message=f"{entity_name.capitalize()}s retrieved successfully", data=items)
+for entity_name, access in entity_access.items():
+    app.include_router(build_entity_router(
+        entity_name, access, on_write=expiry_index.apply if entity_name == "medicine" else None
+    ))
 
 
-async def get_entity(entity_name: str, uuid: str, model: Type[BaseModel], current_user: Person):
-    if current_user.role not in entity_access[entity_name]["read"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    doc = await collections[entity_name].find_one({"uuid": uuid})
-    if not doc:
-        raise HTTPException(status_code=404, detail=f"{entity_name.capitalize()} not found")
-    return APIResponse[model](code=200, message=f"{entity_name.capitalize()} retrieved successfully", data=model(**doc))
-
-
-async def update_entity(entity_name: str, uuid: str, data: BaseModel, current_user: Person):
-    if current_user.role not in entity_access[entity_name]["update"]:
-        raise HTTPException(status_code=403, detail=f"Not authorized to update {entity_name}")
-    doc = await collections[entity_name].find_one({"uuid": uuid})
-    if not doc:
-        raise HTTPException(status_code=404, detail=f"{entity_name.capitalize()} not found")
-    await collections[entity_name].update_one(
-        {"uuid": uuid},
-        {"$set": data.dict(by_alias=True, exclude_unset=True)}
-    )
-    updated_doc = await collections[entity_name].find_one({"uuid": uuid})
-    return APIResponse[BaseModel](code=200, message=f"{entity_name.capitalize()} updated successfully", data=data.__class__(**updated_doc))
-
-
-async def delete_entity(entity_name: str, uuid: str, current_user: Person):
-    if current_user.role not in entity_access[entity_name]["delete"]:
-        raise HTTPException(status_code=403, detail=f"Not authorized to delete {entity_name}")
-    doc = await collections[entity_name].find_one({"uuid": uuid})
-    if not doc:
-        raise HTTPException(status_code=404, detail=f"{entity_name.capitalize()} not found")
-    await collections[entity_name].delete_one({"uuid": uuid})
-    return APIResponse[None](code=200, message=f"{entity_name.capitalize()} deleted successfully", data=None)
-
-@app.post("/allergy", response_model=APIResponse[Allergy])
-async def create_allergy_endpoint(allergy_data: Allergy, current_user: Person = Depends(get_current_user)):
-    return await create_entity("allergy", allergy_data, current_user)
-
-@app.get("/allergy", response_model=APIResponse[List[Allergy]])
-async def list_allergies_endpoint(current_user: Person = Depends(get_current_user)):
-    return await list_entities("allergy", Allergy, current_user)
-
-@app.get("/allergy/{uuid}", response_model=APIResponse[Allergy])
-async def get_allergy_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await get_entity("allergy", uuid, Allergy, current_user)
-
-@app.put("/allergy/{uuid}", response_model=APIResponse[Allergy])
-async def update_allergy_endpoint(uuid: str, allergy_data: Allergy = Body(...), current_user: Person = Depends(get_current_user)):
-    return await update_entity("allergy", uuid, allergy_data, current_user)
-
-@app.delete("/allergy/{uuid}", response_model=APIResponse[None])
-async def delete_allergy_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await delete_entity("allergy", uuid, current_user)
-
-@app.post("/condition", response_model=APIResponse[Condition])
-async def create_condition_endpoint(condition_data: Condition, current_user: Person = Depends(get_current_user)):
-    return await create_entity("condition", condition_data, current_user)
-
-@app.get("/condition", response_model=APIResponse[List[Condition]])
-async def list_conditions_endpoint(current_user: Person = Depends(get_current_user)):
-    return await list_entities("condition", Condition, current_user)
-
-@app.get("/condition/{uuid}", response_model=APIResponse[Condition])
-async def get_condition_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await get_entity("condition", uuid, Condition, current_user)
-
-@app.put("/condition/{uuid}", response_model=APIResponse[Condition])
-async def update_condition_endpoint(uuid: str, condition_data: Condition = Body(...), current_user: Person = Depends(get_current_user)):
-    return await update_entity("condition", uuid, condition_data, current_user)
-
-@app.delete("/condition/{uuid}", response_model=APIResponse[None])
-async def delete_condition_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await delete_entity("condition", uuid, current_user)
-
-@app.post("/medicine", response_model=APIResponse[Medicine])
-async def create_medicine_endpoint(medicine_data: Medicine, current_user: Person = Depends(get_current_user)):
-    return await create_entity("medicine", medicine_data, current_user)
-
-@app.get("/medicine", response_model=APIResponse[List[Medicine]])
-async def list_medicines_endpoint(current_user: Person = Depends(get_current_user)):
-    return await list_entities("medicine", Medicine, current_user)
-
-@app.get("/medicine/{uuid}", response_model=APIResponse[Medicine])
-async def get_medicine_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await get_entity("medicine", uuid, Medicine, current_user)
-
-@app.put("/medicine/{uuid}", response_model=APIResponse[Medicine])
-async def update_medicine_endpoint(uuid: str, medicine_data: Medicine = Body(...), current_user: Person = Depends(get_current_user)):
-    return await update_entity("medicine", uuid, medicine_data, current_user)
-
-@app.delete("/medicine/{uuid}", response_model=APIResponse[None])
-async def delete_medicine_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await delete_entity("medicine", uuid, current_user)
-
-@app.post("/surgery", response_model=APIResponse[Surgery])
-async def create_surgery_endpoint(surgery_data: Surgery, current_user: Person = Depends(get_current_user)):
-    return await create_entity("surgery", surgery_data, current_user)
-
-@app.get("/surgery", response_model=APIResponse[List[Surgery]])
-async def list_surgeries_endpoint(current_user: Person = Depends(get_current_user)):
-    return await list_entities("surgery", Surgery, current_user)
-
-@app.get("/surgery/{uuid}", response_model=APIResponse[Surgery])
-async def get_surgery_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await get_entity("surgery", uuid, Surgery, current_user)
-
-@app.put("/surgery/{uuid}", response_model=APIResponse[Surgery])
-async def update_surgery_endpoint(uuid: str, surgery_data: Surgery = Body(...), current_user: Person = Depends(get_current_user)):
-    return await update_entity("surgery", uuid, surgery_data, current_user)
-
-@app.delete("/surgery/{uuid}", response_model=APIResponse[None])
-async def delete_surgery_endpoint(uuid: str, current_user: Person = Depends(get_current_user)):
-    return await delete_entity("surgery", uuid, current_user)
-
-
-@app.post("/doctor/prescribe-medicine/{patient_uuid}",response_model=APIResponse[Medication])
+@app.post("/doctor/prescribe-medicine/{patient_uuid}",response_model=MedicationResponse)
 async def prescribe_medication(patient_uuid: str, medication_data: Medication = Body(...), current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.DOCTOR:
         raise HTTPException(status_code=403, detail="Only doctors can prescribe medication")
 
     patient_doc = await collections["persons"].find_one(
-        {"uuid": patient_uuid, "role": RoleEnum.PATIENT}
+        live({"uuid": patient_uuid, "role": RoleEnum.PATIENT})
     )
     if not patient_doc:
         raise HTTPException(status_code=404, detail="Patient not found")
-    medicine_doc = await collections["medicine"].find_one({"uuid": medication_data.medicine_id})
+    medicine_doc = await collections["medicine"].find_one(live({"uuid": medication_data.medicine_id}))
     if not medicine_doc:
         raise HTTPException(status_code=404, detail="Medicine not found")
+    # Checked on the document just read rather than the expiry index,
+    # which can lag edits made by other workers or the importer.
+    expiry_date = archive.naive_utc(medicine_doc.get("expiry_date"))
+    if expiry_date is not None and expiry_date <= datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Medicine has expired")
     medical_history = await collections["medical_history"].find_one(
-        {"patient_id": patient_uuid}
+        live({"patient_id": patient_uuid})
     )
     if not medical_history:
         raise HTTPException(status_code=404, detail="Medical history not found")
@@ -478,8 +702,12 @@ async def prescribe_medication(patient_uuid: str, medication_data: Medication =
     )
 
     await collections["medication"].insert_one(new_medication.dict(by_alias=True))
+    await caseload.link(current_user.uuid, patient_uuid, new_medication.medical_history_id, "medication")
+    versions.bump("medication")
+    audit.record(current_user, "create", "medication", new_medication.uuid, patient_uuid)
+    events.hub.publish(new_medication.medical_history_id, "medication.created", new_medication)
 
-    return APIResponse[Medication](
+    return MedicationResponse(
         code=201,
         message="Medication prescribed successfully",
         data=new_medication
@@ -487,33 +715,37 @@ async def prescribe_medication(patient_uuid: str, medication_data: Medication =
 
 
 
-@app.delete("/doctor/prescribe-medicine/{medication_uuid}", response_model=APIResponse[None])
+@app.delete("/doctor/prescribe-medicine/{medication_uuid}", response_model=EmptyResponse)
 async def delete_medication(medication_uuid: str, current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.DOCTOR:
         raise HTTPException(status_code=403, detail="Only doctors can delete medication")
-    medication_doc = await collections["medication"].find_one({"uuid": medication_uuid})
+    medication_doc = await softdelete.delete_one("medication", {"uuid": medication_uuid})
     if not medication_doc:
         raise HTTPException(status_code=404, detail="Medication not found")
-    await collections["medication"].delete_one({"uuid": medication_uuid})
-    return APIResponse[None](code=200, message="Medication deleted successfully", data=None)
+    await caseload.unlink(medication_doc.get("prescribing_doctor_id"), medication_doc.get("medical_history_id"), "medication")
+    versions.bump("medication")
+    patient_id = await audit.patient_of(medication_doc.get("medical_history_id"))
+    audit.record(current_user, "delete", "medication", medication_uuid, patient_id)
+    events.hub.publish(medication_doc.get("medical_history_id"), "medication.deleted", {"uuid": medication_uuid})
+    return EmptyResponse(code=200, message="Medication deleted successfully", data=None)
 
 
-@app.post("/doctor/record-surgery/{patient_uuid}", response_model=APIResponse[PastSurgery])
+@app.post("/doctor/record-surgery/{patient_uuid}", response_model=PastSurgeryResponse)
 async def record_surgery(patient_uuid: str, surgery_data: PastSurgery = Body(...), current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.DOCTOR:
         raise HTTPException(status_code=403, detail="Only doctors can record surgeries")
 
     patient_doc = await collections["persons"].find_one(
-        {"uuid": patient_uuid, "role": RoleEnum.PATIENT}
+        live({"uuid": patient_uuid, "role": RoleEnum.PATIENT})
     )
     if not patient_doc:
         raise HTTPException(status_code=404, detail="Patient not found")
-    surgery_doc = await collections["surgery"].find_one({"uuid": surgery_data.surgery_id})
+    surgery_doc = await collections["surgery"].find_one(live({"uuid": surgery_data.surgery_id}))
     if not surgery_doc:
         raise HTTPException(status_code=404, detail="Surgery not found")
 
     medical_history = await collections["medical_history"].find_one(
-        {"patient_id": patient_uuid}
+        live({"patient_id": patient_uuid})
     )
     if not medical_history:
         raise HTTPException(status_code=404, detail="Medical history not found")
@@ -529,39 +761,47 @@ async def record_surgery(patient_uuid: str, surgery_data: PastSurgery = Body(...
     )
 
     await collections["past_surgery"].insert_one(new_surgery.dict(by_alias=True))
+    await caseload.link(current_user.uuid, patient_uuid, new_surgery.medical_history_id, "past_surgery")
+    versions.bump("past_surgery")
+    audit.record(current_user, "create", "past_surgery", new_surgery.uuid, patient_uuid)
+    events.hub.publish(new_surgery.medical_history_id, "past_surgery.created", new_surgery)
 
-    return APIResponse[PastSurgery](
+    return PastSurgeryResponse(
         code=201,
         message="Surgery recorded successfully",
         data=new_surgery
     )
 
-@app.delete("/doctor/record-surgery/{surgery_uuid}", response_model=APIResponse[None])
+@app.delete("/doctor/record-surgery/{surgery_uuid}", response_model=EmptyResponse)
 async def delete_surgery(surgery_uuid: str, current_user: Person = Depends(get_current_user)):
-    if current_user.role != RoleEnum.DOCTOR or current_user.role != RoleEnum.ADMIN:
-        raise HTTPException(status_code=403, detail="Only doctors can delete surgeries")
-    surgery_doc = await collections["past_surgery"].find_one({"uuid": surgery_uuid})
+    if current_user.role not in (RoleEnum.DOCTOR, RoleEnum.ADMIN):
+        raise HTTPException(status_code=403, detail="Only doctors and admins can delete surgeries")
+    surgery_doc = await softdelete.delete_one("past_surgery", {"uuid": surgery_uuid})
     if not surgery_doc:
         raise HTTPException(status_code=404, detail="Surgery not found")
-    await collections["past_surgery"].delete_one({"uuid": surgery_uuid})
-    return APIResponse[None](code=200, message="Surgery deleted successfully", data=None)
+    await caseload.unlink(surgery_doc.get("surgeon_id"), surgery_doc.get("medical_history_id"), "past_surgery")
+    versions.bump("past_surgery")
+    patient_id = await audit.patient_of(surgery_doc.get("medical_history_id"))
+    audit.record(current_user, "delete", "past_surgery", surgery_uuid, patient_id)
+    events.hub.publish(surgery_doc.get("medical_history_id"), "past_surgery.deleted", {"uuid": surgery_uuid})
+    return EmptyResponse(code=200, message="Surgery deleted successfully", data=None)
 
 
-@app.post("/doctor/diagnose-condition/{patient_uuid}",response_model=APIResponse[ConditionDiagnosis])
+@app.post("/doctor/diagnose-condition/{patient_uuid}",response_model=ConditionDiagnosisResponse)
 async def diagnose_condition(patient_uuid: str, diagnosis_data: ConditionDiagnosis = Body(...), current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.DOCTOR:
         raise HTTPException(status_code=403, detail="Only doctors can diagnose conditions")
     
     patient_doc = await collections["persons"].find_one(
-        {"uuid": patient_uuid, "role": RoleEnum.PATIENT}
+        live({"uuid": patient_uuid, "role": RoleEnum.PATIENT})
     )
     if not patient_doc:
         raise HTTPException(status_code=404, detail="Patient not found")
-    condition_doc = await collections["condition"].find_one({"uuid": diagnosis_data.condition_id})
+    condition_doc = await collections["condition"].find_one(live({"uuid": diagnosis_data.condition_id}))
     if not condition_doc:
         raise HTTPException(status_code=404, detail="Condition not found")
     medical_history = await collections["medical_history"].find_one(
-        {"patient_id": patient_uuid}
+        live({"patient_id": patient_uuid})
     )
     if not medical_history:
         raise HTTPException(status_code=404, detail="Medical history not found")
@@ -576,41 +816,49 @@ async def diagnose_condition(patient_uuid: str, diagnosis_data: ConditionDiagnos
     )
 
     await collections["condition_diagnosis"].insert_one(new_condition.dict(by_alias=True))
+    await caseload.link(current_user.uuid, patient_uuid, new_condition.medical_history_id, "condition_diagnosis")
+    versions.bump("condition_diagnosis")
+    audit.record(current_user, "create", "condition_diagnosis", new_condition.uuid, patient_uuid)
+    events.hub.publish(new_condition.medical_history_id, "condition_diagnosis.created", new_condition)
 
-    return APIResponse[ConditionDiagnosis](
+    return ConditionDiagnosisResponse(
         code=201,
         message="Condition diagnosed successfully",
         data=new_condition
     )
 
 
-@app.delete("/doctor/diagnose-condition/{condition_diagnosis_uuid}", response_model=APIResponse[None])
+@app.delete("/doctor/diagnose-condition/{condition_diagnosis_uuid}", response_model=EmptyResponse)
 async def delete_condition_diagnosis(condition_diagnosis_uuid: str, current_user: Person = Depends(get_current_user)):
-    if current_user.role != RoleEnum.DOCTOR or current_user.role != RoleEnum.ADMIN:
+    if current_user.role not in (RoleEnum.DOCTOR, RoleEnum.ADMIN):
         raise HTTPException(status_code=403, detail="Only doctors and admins can delete condition diagnoses")
-    diagnosis_doc = await collections["condition_diagnosis"].find_one({"uuid": condition_diagnosis_uuid})
+    diagnosis_doc = await softdelete.delete_one("condition_diagnosis", {"uuid": condition_diagnosis_uuid})
     if not diagnosis_doc:
         raise HTTPException(status_code=404, detail="Condition diagnosis not found")
-    await collections["condition_diagnosis"].delete_one({"uuid": condition_diagnosis_uuid})
-    return APIResponse[None](code=200, message="Condition diagnosis deleted successfully", data=None)
-
-@app.post("/doctor/diagnose-allergy/{patient_uuid}", response_model=APIResponse[AllergyDiagnosis])
+    await caseload.unlink(diagnosis_doc.get("diagnosing_doctor_id"), diagnosis_doc.get("medical_history_id"), "condition_diagnosis")
+    versions.bump("condition_diagnosis")
+    patient_id = await audit.patient_of(diagnosis_doc.get("medical_history_id"))
+    audit.record(current_user, "delete", "condition_diagnosis", condition_diagnosis_uuid, patient_id)
+    events.hub.publish(diagnosis_doc.get("medical_history_id"), "condition_diagnosis.deleted", {"uuid": condition_diagnosis_uuid})
+    return EmptyResponse(code=200, message="Condition diagnosis deleted successfully", data=None)
+
+@app.post("/doctor/diagnose-allergy/{patient_uuid}", response_model=AllergyDiagnosisResponse)
 async def diagnose_allergy(patient_uuid: str, diagnosis_data: AllergyDiagnosis = Body(...), current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.DOCTOR:
         raise HTTPException(status_code=403, detail="Only doctors can diagnose allergies")
 
     patient_doc = await collections["persons"].find_one(
-        {"uuid": patient_uuid, "role": RoleEnum.PATIENT}
+        live({"uuid": patient_uuid, "role": RoleEnum.PATIENT})
     )
     if not patient_doc:
         raise HTTPException(status_code=404, detail="Patient not found")
     # Check if allergy exists
-    allergy_doc = await collections["allergy"].find_one({"uuid": diagnosis_data.allergy_id})
+    allergy_doc = await collections["allergy"].find_one(live({"uuid": diagnosis_data.allergy_id}))
     if not allergy_doc:
         raise HTTPException(status_code=404, detail="Allergy not found")
 
     medical_history = await collections["medical_history"].find_one(
-        {"patient_id": patient_uuid}
+        live({"patient_id": patient_uuid})
     )
     if not medical_history:
         raise HTTPException(status_code=404, detail="Medical history not found")
@@ -624,19 +872,27 @@ async def diagnose_allergy(patient_uuid: str, diagnosis_data: AllergyDiagnosis =
     )
 
     await collections["allergy_diagnosis"].insert_one(new_allergy.dict(by_alias=True))
+    await caseload.link(current_user.uuid, patient_uuid, new_allergy.medical_history_id, "allergy_diagnosis")
+    versions.bump("allergy_diagnosis")
+    audit.record(current_user, "create", "allergy_diagnosis", new_allergy.uuid, patient_uuid)
+    events.hub.publish(new_allergy.medical_history_id, "allergy_diagnosis.created", new_allergy)
 
-    return APIResponse[AllergyDiagnosis](
+    return AllergyDiagnosisResponse(
         code=201,
         message="Allergy diagnosed successfully",
         data=new_allergy
     )
 
-@app.delete("/doctor/diagnose-allergy/{allergy_diagnosis_uuid}", response_model=APIResponse[None])
+@app.delete("/doctor/diagnose-allergy/{allergy_diagnosis_uuid}", response_model=EmptyResponse)
 async def delete_allergy_diagnosis(allergy_diagnosis_uuid: str, current_user: Person = Depends(get_current_user)):
     if current_user.role != RoleEnum.DOCTOR:
         raise HTTPException(status_code=403, detail="Only doctors can delete allergy diagnoses")
-    diagnosis_doc = await collections["allergy_diagnosis"].find_one({"uuid": allergy_diagnosis_uuid})
+    diagnosis_doc = await softdelete.delete_one("allergy_diagnosis", {"uuid": allergy_diagnosis_uuid})
     if not diagnosis_doc:
         raise HTTPException(status_code=404, detail="Allergy diagnosis not found")
-    await collections["allergy_diagnosis"].delete_one({"uuid": allergy_diagnosis_uuid})
-    return APIResponse[None](code=200, message="Allergy diagnosis deleted successfully", data=None)
+    await caseload.unlink(diagnosis_doc.get("diagnosing_doctor_id"), diagnosis_doc.get("medical_history_id"), "allergy_diagnosis")
+    versions.bump("allergy_diagnosis")
+    patient_id = await audit.patient_of(diagnosis_doc.get("medical_history_id"))
+    audit.record(current_user, "delete", "allergy_diagnosis", allergy_diagnosis_uuid, patient_id)
+    events.hub.publish(diagnosis_doc.get("medical_history_id"), "allergy_diagnosis.deleted", {"uuid": allergy_diagnosis_uuid})
+    return EmptyResponse(code=200, message="Allergy diagnosis deleted successfully", data=None)
@@ -0,0 +1,171 @@
+"""
+Moves old clinical records out of the hot collections into per-patient,
+column-oriented, zlib-compressed archive chunks.
+
+    python -m src.archive                 # uses ARCHIVE_AFTER_DAYS
+    python -m src.archive --days 3650
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from bson import Binary, json_util
+from pymongo import UpdateOne
+
+from .database import collections
+from . import versions
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 5 * 365))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+
+# Field that dates each clinical record. A medication is aged by when it
+# ended, so current prescriptions (no ending_date) are never archived.
+DATE_FIELDS = {
+    "medication": "ending_date",
+    "past_surgery": "date",
+    "condition_diagnosis": "diagnosis_date",
+    "allergy_diagnosis": "diagnosis_date",
+}
+# Allergies stay clinically relevant for life, so they are not archived
+# unless listed explicitly.
+ARCHIVED_COLLECTIONS = [
+    name.strip()
+    for name in os.getenv("ARCHIVED_COLLECTIONS", "medication,past_surgery,condition_diagnosis").split(",")
+    if name.strip()
+]
+
+
+def archive_of(name: str):
+    return collections[f"{name}_archive"]
+
+
+async def ensure_indexes():
+    for name, field in DATE_FIELDS.items():
+        await collections[name].create_index([("medical_history_id", 1), (field, 1)])
+        await archive_of(name).create_index([("medical_history_id", 1), ("max_date", 1)])
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Stored dates are naive UTC; bring client-supplied aware datetimes in line.
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def since_filter(name: str, since: Optional[datetime]) -> dict:
+    """
+    Hot-collection filter for records dated on/after `since`; undated
+    records are always kept.
+    """
+    if since is None:
+        return {}
+    field = DATE_FIELDS[name]
+    return {"$or": [{field: {"$gte": since}}, {field: None}]}
+
+
+def _pack(name: str, medical_history_id: str, docs: List[dict]) -> dict:
+    fields = sorted({key for doc in docs for key in doc})
+    columns = [[doc.get(field) for doc in docs] for field in fields]
+    payload = json_util.dumps({"fields": fields, "columns": columns}).encode()
+    dates = [doc[DATE_FIELDS[name]] for doc in docs]
+    return {
+        # Derived from the rows, so re-archiving the same batch after a
+        # crash finds the existing chunk instead of adding a second one.
+        "_id": hashlib.sha1(",".join(str(doc["_id"]) for doc in docs).encode()).hexdigest(),
+        "medical_history_id": medical_history_id,
+        "count": len(docs),
+        "min_date": min(dates),
+        "max_date": max(dates),
+        "archived_at": datetime.utcnow(),
+        "data": Binary(zlib.compress(payload, 6)),
+    }
+
+
+def _unpack(chunk: dict) -> List[dict]:
+    payload = json_util.loads(zlib.decompress(chunk["data"]))
+    fields = payload["fields"]
+    return [dict(zip(fields, row)) for row in zip(*payload["columns"])]
+
+
+async def archive_collection(name: str, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Archive records of `name` dated before `cutoff`. Each batch is written
+    to the archive before it is deleted from the hot collection. A crash in
+    between is repaired by the next run: batches are taken in _id order and
+    chunk ids are derived from their rows, so the same chunks are upserted
+    again; load_archived drops any duplicate rows that remain.
+    """
+    field = DATE_FIELDS[name]
+    hot = collections[name]
+    moved = 0
+    while True:
+        # Soft-deleted rows are left to the softdelete compactor.
+        cursor = hot.find({field: {"$lt": cutoff}, "deleted_at": None}).sort("_id", 1).limit(batch_size)
+        docs = [doc async for doc in cursor]
+        if not docs:
+            break
+        by_history: Dict[str, List[dict]] = {}
+        for doc in docs:
+            by_history.setdefault(doc.get("medical_history_id"), []).append(doc)
+        chunks = [_pack(name, history_id, group) for history_id, group in by_history.items()]
+        await archive_of(name).bulk_write(
+            [UpdateOne({"_id": chunk.pop("_id")}, {"$setOnInsert": chunk}, upsert=True) for chunk in chunks],
+            ordered=False,
+        )
+        await hot.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        moved += len(docs)
+    if moved:
+        versions.bump(name, f"{name}_archive")
+    return moved
+
+
+async def archive_all(days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, int]:
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    return {name: await archive_collection(name, cutoff) for name in ARCHIVED_COLLECTIONS}
+
+
+async def load_archived(name: str, medical_history_id: str, since: Optional[datetime] = None) -> List[dict]:
+    query = {"medical_history_id": medical_history_id}
+    if since is not None:
+        query["max_date"] = {"$gte": since}
+    field = DATE_FIELDS[name]
+    rows = []
+    seen = set()
+    async for chunk in archive_of(name).find(query).sort("min_date", 1):
+        for row in _unpack(chunk):
+            if since is not None and row.get(field) is not None and row[field] < since:
+                continue
+            # A row can sit in two chunks if archiving was interrupted and
+            # re-run with a different batch.
+            if row.get("uuid") is not None:
+                if row["uuid"] in seen:
+                    continue
+                seen.add(row["uuid"])
+            rows.append(row)
+    return rows
+
+
+async def forget(medical_history_id: str):
+    for name in DATE_FIELDS:
+        await archive_of(name).delete_many({"medical_history_id": medical_history_id})
+
+
+async def _main(days: int) -> Dict[str, int]:
+    try:
+        return await archive_all(days)
+    finally:
+        await versions.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old clinical records.")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    moved = asyncio.run(_main(parser.parse_args().days))
+    for name, count in moved.items():
+        print(f"{name}: {count} records archived")
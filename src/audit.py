@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from .database import collections, db
+from .periodic import Periodic
+
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 500))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", 1.0))
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", 50_000))
+AUDIT_INSERT_TIMEOUT = float(os.getenv("AUDIT_INSERT_TIMEOUT", 5.0))
+AUDIT_SPILL_PATH = os.getenv("AUDIT_SPILL_PATH", "audit_spill.ndjson")
+
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+
+def partition_name(ts: datetime) -> str:
+    """
+    Audit events are partitioned by month, so old months can be exported
+    or dropped as whole collections.
+    """
+    return f"audit_log_{ts:%Y%m}"
+
+
+class AuditLog:
+    """
+    Buffers PHI access and mutation events in memory and writes them with
+    insert_many when a batch fills up or every `flush_seconds`.
+
+    `record` never awaits. If Mongo is slow or down, batches go to an NDJSON
+    spill file and are replayed on the next successful flush; if the buffer
+    itself fills up, the oldest batch is spilled straight away. File I/O
+    runs on one background thread, which also keeps spill writes in order.
+    A replay interrupted by a crash is picked up again at start.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_seconds: float = AUDIT_FLUSH_SECONDS,
+        max_buffer: int = AUDIT_MAX_BUFFER,
+        spill_path: str = AUDIT_SPILL_PATH,
+    ):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.spill_path = spill_path
+        self._buffer = deque()
+        self._flusher = Periodic("Audit flush", flush_seconds, self.flush)
+        self._io: Optional[ThreadPoolExecutor] = None
+        self._indexed = set()
+
+    def record(self, actor, action: str, entity: str, entity_id: Optional[str] = None,
+               patient_id: Optional[str] = None):
+        self._buffer.append({
+            # Assigned here so a batch that is retried after a timeout
+            # cannot be stored twice.
+            "_id": ObjectId(),
+            "ts": datetime.utcnow(),
+            "actor_id": actor.uuid if actor else None,
+            "actor_role": actor.role if actor else None,
+            "action": action,
+            "entity": entity,
+            "entity_id": entity_id,
+            "patient_id": patient_id,
+        })
+        if len(self._buffer) >= self.max_buffer:
+            batch = self._take(self.batch_size)
+            if self._io is not None:
+                self._io.submit(self._write_spill, batch)
+            else:
+                self._write_spill(batch)
+        if len(self._buffer) >= self.batch_size:
+            self._flusher.wake()
+
+    def _take(self, count: int):
+        return [self._buffer.popleft() for _ in range(min(count, len(self._buffer)))]
+
+    async def start(self):
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-spill")
+        if os.path.exists(self._replaying):
+            try:
+                await self._replay_spill()
+            except Exception:
+                logger.exception("Replaying the audit spill file failed")
+        self._flusher.start()
+
+    async def stop(self):
+        await self._flusher.stop()
+        await self.flush()
+        if self._io is not None:
+            self._io.shutdown(wait=True)
+            self._io = None
+
+    async def flush(self):
+        wrote = False
+        while self._buffer:
+            batch = self._take(self.batch_size)
+            if await self._insert(batch):
+                wrote = True
+            else:
+                await self._spill(batch + self._take(len(self._buffer)))
+                return
+        if wrote:
+            # Checked on the I/O thread, behind any spill write still queued.
+            await self._replay_spill()
+
+    async def _insert(self, batch) -> bool:
+        partitions = {}
+        for event in batch:
+            partitions.setdefault(partition_name(event["ts"]), []).append(event)
+        for name, events in partitions.items():
+            try:
+                if name not in self._indexed:
+                    await db[name].create_index([("patient_id", 1), ("ts", 1)])
+                    self._indexed.add(name)
+                await asyncio.wait_for(
+                    db[name].insert_many(events, ordered=False), timeout=AUDIT_INSERT_TIMEOUT
+                )
+            except BulkWriteError as e:
+                # Duplicates are events already stored by an earlier,
+                # timed-out attempt; anything else is a real failure.
+                if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                    return False
+            except Exception:
+                logger.warning("Audit insert failed, spilling %d events to %s", len(batch), self.spill_path)
+                return False
+        return True
+
+    @property
+    def _replaying(self) -> str:
+        return self.spill_path + ".replay"
+
+    async def _in_io(self, fn, *args):
+        if self._io is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._io, fn, *args)
+
+    async def _spill(self, batch):
+        await self._in_io(self._write_spill, batch)
+
+    def _write_spill(self, batch):
+        if not batch:
+            return
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            f.writelines(json_util.dumps(event) + "\n" for event in batch)
+
+    def _read_spill(self) -> Optional[List[dict]]:
+        # A .replay file still there is one a crash interrupted; finish it
+        # before taking the current spill file.
+        if not os.path.exists(self._replaying):
+            if not os.path.exists(self.spill_path):
+                return None
+            os.replace(self.spill_path, self._replaying)
+        with open(self._replaying, encoding="utf-8") as f:
+            return [json_util.loads(line) for line in f if line.strip()]
+
+    def _finish_replay(self, unsent: List[dict]):
+        self._write_spill(unsent)
+        os.remove(self._replaying)
+
+    async def _replay_spill(self):
+        # Events keep their _id, so re-inserting some after a crash is harmless.
+        events = await self._in_io(self._read_spill)
+        if events is None:
+            return
+        unsent = []
+        for start in range(0, len(events), self.batch_size):
+            if not await self._insert(events[start:start + self.batch_size]):
+                unsent = events[start:]
+                break
+        await self._in_io(self._finish_replay, unsent)
+
+
+audit_log = AuditLog()
+
+
+def record(actor, action: str, entity: str, entity_id: Optional[str] = None,
+           patient_id: Optional[str] = None):
+    audit_log.record(actor, action, entity, entity_id, patient_id)
+
+
+async def patients_of(field: str, docs: Iterable[dict]) -> List[str]:
+    """
+    Distinct patients of the given documents, which reference them by
+    `field`: patient_id directly, or medical_history_id (clinical records).
+    """
+    refs = list(dict.fromkeys(doc[field] for doc in docs if doc.get(field)))
+    if field == "patient_id" or not refs:
+        return refs
+    cursor = collections["medical_history"].find({"uuid": {"$in": refs}}, {"patient_id": 1})
+    return list(dict.fromkeys([history["patient_id"] async for history in cursor if history.get("patient_id")]))
+
+
+async def patient_of(medical_history_id: Optional[str]) -> Optional[str]:
+    """
+    Patient a clinical record belongs to, for its audit events.
+    """
+    patients = await patients_of("medical_history_id", [{"medical_history_id": medical_history_id}])
+    return patients[0] if patients else None
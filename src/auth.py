@@ -1,4 +1,6 @@
 import json
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
@@ -8,14 +10,22 @@ from passlib.context import CryptContext
 
 from .schema import Person
 from .database import collections
-from dotenv import load_dotenv
+from .revocation import revocations
+from .softdelete import live
 import os
 
-load_dotenv()
+if "SECRET_KEY" not in os.environ:
+    # Only development needs the .env file; read it directly instead of
+    # letting python-dotenv search for it.
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 SECRET_KEY = os.getenv("SECRET_KEY")
-print(SECRET_KEY)
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 360
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+# A rotated refresh token presented again this soon is another tab
+# refreshing concurrently, not a leak.
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", 30))
 
 # Use bcrypt (ensure passlib[bcrypt] is installed)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -35,15 +45,115 @@ def hash_password(password: str) -> str:
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    # iat keeps sub-second precision so a user revocation never catches a
+    # token issued right after it.
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex, "type": "access"})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+async def create_session(user: Person) -> dict:
+    """
+    Starts a refresh session for `user` and returns a short-lived access
+    token plus the refresh token that renews it.
+    """
+    session_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    expires_at = now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    await collections["sessions"].insert_one({
+        "_id": session_id,
+        "user_id": user.uuid,
+        "created_at": now,
+        "expires_at": expires_at,
+    })
+    access_token = create_access_token(
+        data={"sub": user.username, "role": user.role, "uuid": user.uuid, "sid": session_id}
+    )
+    refresh_token = jwt.encode(
+        {"sub": user.username, "uuid": user.uuid, "jti": session_id, "type": "refresh",
+         "iat": time.time(), "exp": expires_at},
+        SECRET_KEY, algorithm=ALGORITHM,
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+async def refresh_session(refresh_token: str):
+    """
+    Exchanges a refresh token for a new token pair. Refresh tokens are
+    single use. A rotated session is kept as a tombstone until the token
+    would have expired, and presenting its token again after the grace
+    period means it leaked, so every session of its user is revoked.
+    Tokens of logged-out or unknown sessions are just rejected.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        claims = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if claims.get("type") != "refresh" or not claims.get("jti") or not claims.get("uuid"):
+        raise credentials_exception
+
+    now = datetime.utcnow()
+    session = await collections["sessions"].find_one_and_update(
+        {"_id": claims["jti"], "rotated_at": None}, {"$set": {"rotated_at": now}}
+    )
+    if session is None:
+        tombstone = await collections["sessions"].find_one({"_id": claims["jti"]})
+        if tombstone is not None and now - tombstone["rotated_at"] > timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+            await revoke_user(claims["uuid"])
+        raise credentials_exception
+    if revocations.is_revoked(claims):
+        raise credentials_exception
+
+    user_doc = await collections["persons"].find_one(live({"uuid": claims["uuid"]}))
+    if user_doc is None:
+        raise credentials_exception
+    user = Person(**user_doc)
+    return user, await create_session(user)
+
+
+async def revoke_access_token(claims: dict):
+    """
+    Logs out the session the access token belongs to.
+    """
+    await revocations.revoke_token(claims["jti"], datetime.utcfromtimestamp(claims["exp"]))
+    if claims.get("sid"):
+        await collections["sessions"].delete_one({"_id": claims["sid"]})
+
+
+async def revoke_user(user_uuid: str):
+    """
+    Invalidates every token and session of a user, e.g. after deletion or a
+    role change.
+    """
+    await revocations.revoke_user(user_uuid, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    await collections["sessions"].delete_many({"user_id": user_uuid})
+
+
+async def ensure_indexes():
+    await collections["sessions"].create_index("expires_at", expireAfterSeconds=0)
+    await collections["sessions"].create_index("user_id")
+    # Backs the "Username already exists" checks against concurrent
+    # signups and imports. Matches string usernames only, so accounts
+    # without one don't collide on null.
+    await collections["persons"].create_index(
+        "username", unique=True, partialFilterExpression={"username": {"$gt": ""}}
+    )
+
+
 async def authenticate_user(username: str, password: str) -> Optional[Person]:
     """
     Returns a Person if username/password match, else None.
     """
-    user_doc = await collections["persons"].find_one({"username": username})
+    user_doc = await collections["persons"].find_one(live({"username": username}))
     if not user_doc:
         return None
     user = Person(**user_doc)
@@ -52,10 +162,10 @@ async def authenticate_user(username: str, password: str) -> Optional[Person]:
     return user
 
 
-async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)) -> Optional[Person]:
+async def get_token_claims(token: Optional[str] = Depends(oauth2_scheme)) -> Optional[dict]:
     """
-    Returns Person from token WITHOUT verifying signature.
-    Only for testing / local development.
+    Returns the claims of a valid, unrevoked access token, or None when no
+    token was sent. Checked entirely in memory.
     """
     if not token:
         return None  # allow unauthenticated access
@@ -67,26 +177,25 @@ async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)) -> Opt
     )
 
     try:
-        print("Token received:", token)
-        # Decode WITHOUT verifying signature
-        payload = jwt.decode(token, key=None, algorithms=None, options={"verify_signature": False})
-        print("JWT payload:", payload)
-        username: str = payload.get("sub")
-        if not username:
-            raise credentials_exception
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise credentials_exception
-
-    user_doc = await collections["persons"].find_one({"username": username})
-    if user_doc is None:
+    if payload.get("type") != "access" or not payload.get("sub") or not payload.get("uuid"):
         raise credentials_exception
-    if "DOB" in user_doc and isinstance(user_doc["DOB"], datetime):
-        user_doc["DOB"] = user_doc["DOB"].isoformat()
-    print("DONE")
-    print(user_doc)
-    person = Person(**user_doc)
-    return person
+    if revocations.is_revoked(payload):
+        raise credentials_exception
+    return payload
+
 
+async def get_current_user(claims: Optional[dict] = Depends(get_token_claims)) -> Optional[Person]:
+    """
+    Returns the Person described by the access token, without a database
+    round trip. Deleted users and role changes are locked out through the
+    revocation list instead of a per-request lookup.
+    """
+    if claims is None:
+        return None
+    return Person(username=claims["sub"], uuid=claims["uuid"], role=claims.get("role"))
 
 
 async def get_current_active_user(current_user: Person = Depends(get_current_user)) -> Person:
@@ -0,0 +1,161 @@
+"""
+Doctor -> patient edges, maintained on every clinical write so a doctor's
+caseload is one indexed query instead of a fan-out over the clinical
+collections and medical_history.
+
+Rebuild from existing records with:
+
+    python -m src.caseload rebuild
+"""
+import asyncio
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo import DESCENDING
+
+from .database import collections
+from .schema import MongoBaseModel, Person, RoleEnum
+
+# Clinical collection -> field naming the doctor who wrote the record
+CLINICAL_LINKS = {
+    "medication": "prescribing_doctor_id",
+    "past_surgery": "surgeon_id",
+    "condition_diagnosis": "diagnosing_doctor_id",
+    "allergy_diagnosis": "diagnosing_doctor_id",
+}
+
+
+class CaseloadEntry(MongoBaseModel):
+    patient: Person
+    record_count: int
+    last_activity: Optional[datetime]
+
+
+async def ensure_indexes(edges=None):
+    edges = edges if edges is not None else collections["doctor_patients"]
+    await edges.create_index([("doctor_id", 1), ("medical_history_id", 1)], unique=True)
+    await edges.create_index([("doctor_id", 1), ("last_activity", DESCENDING)])
+    await edges.create_index("patient_id")
+
+
+def activity_time(doc: dict) -> datetime:
+    """
+    When a clinical record was written, taken from its ObjectId. The same
+    definition backs link() and rebuild(), so a rebuild keeps the order of
+    caseloads; clinical dates can lie in the past or future.
+    """
+    return doc["_id"].generation_time.replace(tzinfo=None)
+
+
+async def link(doctor_id: str, patient_id: str, medical_history_id: str, kind: str):
+    # Whole seconds, like the ObjectId times rebuild() reads back.
+    now = datetime.utcnow().replace(microsecond=0)
+    await collections["doctor_patients"].update_one(
+        {"doctor_id": doctor_id, "medical_history_id": medical_history_id},
+        {
+            "$inc": {"record_count": 1, f"counts.{kind}": 1},
+            "$set": {"patient_id": patient_id},
+            "$max": {"last_activity": now},
+            "$setOnInsert": {"first_activity": now},
+        },
+        upsert=True,
+    )
+
+
+async def unlink(doctor_id: Optional[str], medical_history_id: Optional[str], kind: str):
+    if not doctor_id or not medical_history_id:
+        return
+    edge = {"doctor_id": doctor_id, "medical_history_id": medical_history_id}
+    await collections["doctor_patients"].update_one(
+        edge, {"$inc": {"record_count": -1, f"counts.{kind}": -1}}
+    )
+    await collections["doctor_patients"].delete_one({**edge, "record_count": {"$lte": 0}})
+
+
+async def forget_patient(patient_id: str):
+    await collections["doctor_patients"].delete_many({"patient_id": patient_id})
+
+
+async def forget_doctor(doctor_id: str):
+    await collections["doctor_patients"].delete_many({"doctor_id": doctor_id})
+
+
+async def patients_of(doctor_id: str, skip: int, limit: int) -> List[CaseloadEntry]:
+    """
+    Most recently treated first. Two indexed queries regardless of how
+    many clinical records the doctor has written.
+    """
+    cursor = (
+        collections["doctor_patients"]
+        .find({"doctor_id": doctor_id}, {"patient_id": 1, "record_count": 1, "last_activity": 1})
+        .sort("last_activity", DESCENDING)
+        .skip(skip)
+        .limit(limit)
+    )
+    edges = [edge async for edge in cursor]
+    if not edges:
+        return []
+    patient_ids = [edge["patient_id"] for edge in edges]
+    people = {}
+    async for doc in collections["persons"].find(
+        {"uuid": {"$in": patient_ids}, "role": RoleEnum.PATIENT, "deleted_at": None}, {"password": 0}
+    ):
+        people[doc["uuid"]] = Person(**doc)
+    return [
+        CaseloadEntry(patient=people[edge["patient_id"]], record_count=edge["record_count"],
+                      last_activity=edge.get("last_activity"))
+        for edge in edges if edge["patient_id"] in people
+    ]
+
+
+async def rebuild():
+    """
+    Recompute every edge from the clinical collections. The edges are
+    built in a side collection and renamed over the live one, so
+    caseloads stay readable throughout; clinical writes made while it runs
+    are not reflected.
+    """
+    histories = {}
+    # Soft-deleted records (see softdelete.py) carry deleted_at and are skipped.
+    async for doc in collections["medical_history"].find({"deleted_at": None}, {"uuid": 1, "patient_id": 1}):
+        histories[doc["uuid"]] = doc.get("patient_id")
+
+    edges = {}
+    for name, doctor_field in CLINICAL_LINKS.items():
+        cursor = collections[name].find({"deleted_at": None}, {doctor_field: 1, "medical_history_id": 1})
+        async for doc in cursor:
+            key = (doc.get(doctor_field), doc.get("medical_history_id"))
+            if not key[0] or key[1] not in histories:
+                continue
+            when = activity_time(doc)
+            edge = edges.setdefault(
+                key, {"record_count": 0, "counts": {}, "first_activity": when, "last_activity": when}
+            )
+            edge["record_count"] += 1
+            edge["counts"][name] = edge["counts"].get(name, 0) + 1
+            edge["first_activity"] = min(edge["first_activity"], when)
+            edge["last_activity"] = max(edge["last_activity"], when)
+
+    if not edges:
+        await collections["doctor_patients"].delete_many({})
+        return 0
+    staging = collections["doctor_patients_rebuild"]
+    # Left over if a previous rebuild died before the rename.
+    await staging.drop()
+    await ensure_indexes(staging)
+    docs = [
+        {**edge, "doctor_id": doctor_id, "medical_history_id": medical_history_id,
+         "patient_id": histories[medical_history_id]}
+        for (doctor_id, medical_history_id), edge in edges.items()
+    ]
+    for start in range(0, len(docs), 1000):
+        await staging.insert_many(docs[start:start + 1000], ordered=False)
+    await staging.rename(collections["doctor_patients"].name, dropTarget=True)
+    return len(docs)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m src.caseload rebuild")
+    print(f"{asyncio.run(rebuild())} doctor-patient edges written")
@@ -0,0 +1,132 @@
+import gzip
+import os
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+# Bodies larger than this are compressed off the event loop.
+COMPRESSION_THREAD_SIZE = 1 << 20
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=5)
+
+
+def _brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=4)
+
+
+def _zstd(body: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=3).compress(body)
+
+
+# Server preference order; encodings whose library is missing are skipped.
+ENCODERS = [
+    (name, encoder) for name, encoder, available in (
+        ("zstd", _zstd, zstandard is not None),
+        ("br", _brotli, brotli is not None),
+        ("gzip", _gzip, True),
+    ) if available
+]
+
+
+def _accepted(accept_encoding: str):
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+    return accepted
+
+
+def negotiate(accept_encoding: str):
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    best = None
+    for name, encoder in ENCODERS:
+        q = accepted.get(name, wildcard)
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, name, encoder)
+    return best[1:] if best else None
+
+
+class CompressionMiddleware:
+    """
+    Compresses single-chunk responses above `minimum_size` with the best
+    encoding the client accepts (zstd, br, gzip).
+
+    Streaming responses (SSE, exports) are passed through untouched so
+    they are never buffered.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        chosen = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if chosen is None:
+            await self.app(scope, receive, send)
+            return
+        name, encoder = chosen
+        start_message = None
+
+        async def compressing_send(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) > COMPRESSION_THREAD_SIZE:
+                body = await anyio.to_thread.run_sync(encoder, body)
+            else:
+                body = encoder(body)
+            headers["Content-Encoding"] = name
+            headers["Content-Length"] = str(len(body))
+            etag = headers.get("etag")
+            if etag and etag.endswith('"') and not etag.startswith("W/"):
+                headers["ETag"] = f'{etag[:-1]}-{name}"'
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compressing_send)
@@ -1,6 +1,17 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+import os
 
-client = AsyncIOMotorClient("mongodb://localhost:27017")
+from .profiler import event_listeners
+
+# "mongo" (default) or "memory" for the in-process stand-in in memory_db.py.
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "mongo")
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+
+if DATABASE_BACKEND == "memory":
+    from .memory_db import MemoryClient
+    client = MemoryClient()
+else:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(MONGO_URL, event_listeners=event_listeners())
 db = client["hospital"]
 
 collections = {
@@ -15,4 +26,16 @@ collections = {
     "past_surgery": db["past_surgeries"],
     "medical_history": db["medical_histories"],
     "insurance": db["insurances"],
+    "idempotency_keys": db["idempotency_keys"],
+    "doctor_patients": db["doctor_patients"],
+    "doctor_patients_rebuild": db["doctor_patients_rebuild"],
+    "sessions": db["sessions"],
+    "revoked_tokens": db["revoked_tokens"],
+    "medication_archive": db["medications_archive"],
+    "past_surgery_archive": db["past_surgeries_archive"],
+    "condition_diagnosis_archive": db["condition_diagnoses_archive"],
+    "allergy_diagnosis_archive": db["allergy_diagnoses_archive"],
+    "rate_limits": db["rate_limits"],
+    "versions": db["versions"],
+    "leases": db["leases"],
 }
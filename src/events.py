@@ -0,0 +1,116 @@
+import asyncio
+import itertools
+import json
+import os
+from typing import Dict, Set
+
+from fastapi.encoders import jsonable_encoder
+
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", 100))
+MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", 1000))
+HEARTBEAT_SECONDS = 15
+
+
+class SubscriberLimitReached(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, key: str, buffer_size: int):
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.closed = False
+
+
+class EventHub:
+    """
+    In-process pub/sub keyed by medical history id.
+
+    Publishing never waits on a subscriber: a connection whose buffer is
+    full is cut off with a single `resync` event, telling the client to
+    reload the chart once instead of receiving a partial stream.
+    """
+
+    def __init__(self, buffer_size: int = EVENT_BUFFER_SIZE, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._count = 0
+        self._ids = itertools.count(1)
+
+    def has_capacity(self) -> bool:
+        return self._count < self.max_subscribers
+
+    def subscribe(self, key: str) -> Subscription:
+        if not self.has_capacity():
+            raise SubscriberLimitReached()
+        subscription = Subscription(key, self.buffer_size)
+        self._subscribers.setdefault(key, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.key)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.key]
+        self._count -= 1
+
+    def publish(self, key: str, event: str, data=None):
+        subscribers = self._subscribers.get(key)
+        if not subscribers:
+            return
+        # Serialized once, shared by every subscriber of the chart.
+        message = format_event(event, jsonable_encoder(data), next(self._ids))
+        for subscription in list(subscribers):
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._overflow(subscription)
+
+    def _overflow(self, subscription: Subscription):
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(format_event("resync", None, next(self._ids)))
+        subscription.closed = True
+        self.unsubscribe(subscription)
+
+
+def format_event(event: str, data, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream(key: str, hub: EventHub, request):
+    """
+    Server-Sent Events body for the events of `key`. The subscription is
+    taken on the first iteration, so a response that is never started
+    (client gone before the body is sent) holds no slot; once taken it is
+    always released.
+    """
+    try:
+        subscription = hub.subscribe(key)
+    except SubscriberLimitReached:
+        # Filled up since the handler checked; the client reconnects
+        # after the retry delay and gets a proper 503.
+        yield "retry: 5000\n\n"
+        return
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+                continue
+            yield message
+            if subscription.closed and subscription.queue.empty():
+                return
+    finally:
+        hub.unsubscribe(subscription)
+
+
+hub = EventHub()
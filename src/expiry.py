@@ -0,0 +1,150 @@
+"""
+In-memory timeline of medicine expiry dates, loaded once from the
+expiry_date index and kept current by the medicine write paths.
+
+Expirations are two parallel lists (dates sorted ascending, uuids), so a
+"what expires within N days" query is a bisect plus a slice instead of
+a catalog scan; a uuid -> expiry dict finds an entry to replace or drop.
+Prescriptions check the medicine document itself, which is never stale.
+A background sweep wakes at the next expiry date and logs what has just
+gone out of date.
+"""
+import logging
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from .archive import naive_utc
+from .database import collections
+from .periodic import Periodic
+from .softdelete import live
+
+EXPIRY_REFRESH_SECONDS = float(os.getenv("EXPIRY_REFRESH_SECONDS", 300))
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryIndex:
+    def __init__(self):
+        self.ready = False
+        self._expiry: Dict[str, datetime] = {}
+        self._docs: Dict[str, dict] = {}
+        self._dates: List[datetime] = []
+        self._uuids: List[str] = []
+        self._swept_until: Optional[datetime] = None
+        self._loaded_at: Optional[datetime] = None
+        # Wakes at the next expiry date, and at least every refresh
+        # interval to pick up catalog changes made by other workers.
+        self._sweeper = Periodic(
+            "Expiry sweep", lambda: max(self._next_wake(datetime.utcnow()), 1), self._refresh
+        )
+
+    def __len__(self):
+        return len(self._expiry)
+
+    async def ensure_indexes(self):
+        await collections["medicine"].create_index("expiry_date")
+
+    async def load(self):
+        expiry, docs, dates, uuids = {}, {}, [], []
+        cursor = collections["medicine"].find(
+            live({"expiry_date": {"$ne": None}}), {"deleted_at": 0}
+        ).sort("expiry_date", 1)
+        async for doc in cursor:
+            expires = naive_utc(doc["expiry_date"])
+            expiry[doc["uuid"]] = expires
+            docs[doc["uuid"]] = doc
+            dates.append(expires)
+            uuids.append(doc["uuid"])
+        self._expiry, self._docs, self._dates, self._uuids = expiry, docs, dates, uuids
+        self._swept_until = self._swept_until or datetime.utcnow()
+        self._loaded_at = datetime.utcnow()
+        self.ready = True
+        logger.info("Expiry index loaded: %d medicines with an expiry date", len(expiry))
+
+    def put(self, doc: dict):
+        uuid = doc.get("uuid")
+        if not uuid:
+            return
+        self.remove(uuid)
+        expires = naive_utc(doc.get("expiry_date"))
+        if expires is None:
+            return
+        i = bisect_right(self._dates, expires)
+        self._dates.insert(i, expires)
+        self._uuids.insert(i, uuid)
+        self._expiry[uuid] = expires
+        self._docs[uuid] = doc
+
+    def remove(self, uuid: str):
+        expires = self._expiry.pop(uuid, None)
+        self._docs.pop(uuid, None)
+        if expires is None:
+            return
+        i = bisect_left(self._dates, expires)
+        while i < len(self._dates) and self._dates[i] == expires:
+            if self._uuids[i] == uuid:
+                del self._dates[i]
+                del self._uuids[i]
+                return
+            i += 1
+
+    def apply(self, written: Iterable[dict] = (), removed: Iterable[str] = ()):
+        """
+        Write hook for the medicine router: `written` are the documents
+        as stored after a create/update, `removed` the deleted uuids.
+        """
+        for doc in written:
+            self.put(doc)
+        for uuid in removed:
+            self.remove(uuid)
+
+    def expiring(self, within: timedelta, now: Optional[datetime] = None,
+                 include_expired: bool = False) -> List[dict]:
+        """
+        Medicines expiring between now and now + `within`, soonest first;
+        with `include_expired`, everything already past its date as well.
+        """
+        now = now or datetime.utcnow()
+        start = 0 if include_expired else bisect_right(self._dates, now)
+        end = bisect_right(self._dates, now + within)
+        return [self._docs[uuid] for uuid in self._uuids[start:end]]
+
+    def sweep(self, now: Optional[datetime] = None) -> List[str]:
+        """
+        Uuids of medicines that expired since the previous sweep.
+        """
+        now = now or datetime.utcnow()
+        since = self._swept_until or now
+        expired = self._uuids[bisect_right(self._dates, since):bisect_right(self._dates, now)]
+        self._swept_until = now
+        return expired
+
+    def _next_wake(self, now: datetime) -> float:
+        i = bisect_right(self._dates, now)
+        if i < len(self._dates):
+            return min(EXPIRY_REFRESH_SECONDS, (self._dates[i] - now).total_seconds())
+        return EXPIRY_REFRESH_SECONDS
+
+    async def start(self):
+        try:
+            await self.ensure_indexes()
+            await self.load()
+        except Exception:
+            logger.exception("Expiry index load failed; expired medicines are not flagged")
+        self._sweeper.start()
+
+    async def stop(self):
+        await self._sweeper.stop()
+
+    async def _refresh(self):
+        now = datetime.utcnow()
+        if not self.ready or (now - self._loaded_at).total_seconds() >= EXPIRY_REFRESH_SECONDS:
+            await self.load()
+        for uuid in self.sweep(now):
+            doc = self._docs.get(uuid, {})
+            logger.warning("Medicine %s (%s) expired on %s", uuid, doc.get("name"), doc.get("expiry_date"))
+
+
+expiry_index = ExpiryIndex()
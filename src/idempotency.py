@@ -0,0 +1,201 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from jose import JWTError, jwt
+from pymongo.errors import DuplicateKeyError
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from .auth import ALGORITHM, SECRET_KEY
+from .database import collections
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+# A key left "pending" longer than this belongs to a request that died
+# mid-flight (worker crash, restart) and may be taken over by a retry.
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv("IDEMPOTENCY_PENDING_SECONDS", 60))
+MAX_KEY_LENGTH = 255
+
+# Write endpoints whose retries must not create duplicate records.
+IDEMPOTENT_ROUTES = (
+    "/signup",
+    "/doctor/prescribe-medicine/",
+    "/doctor/record-surgery/",
+    "/doctor/diagnose-condition/",
+    "/doctor/diagnose-allergy/",
+)
+
+
+async def ensure_indexes():
+    # Records are keyed by _id, so a replay is a single primary-key lookup;
+    # the TTL index only exists to expire old keys.
+    await collections["idempotency_keys"].create_index(
+        "created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS
+    )
+
+
+def _caller(headers: Headers) -> str:
+    """
+    Scope keys per caller so two users can never see each other's responses.
+    Responses are replayed before authentication runs, so the token is
+    verified here; a forged or expired one only scopes to itself.
+    """
+    authorization = headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return "anonymous"
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return "token:" + hashlib.sha256(token.encode()).hexdigest()
+    return claims.get("uuid") or claims.get("sub") or "anonymous"
+
+
+def _record_id(key: str, caller: str) -> str:
+    return hashlib.sha256(f"{caller}\x00{key}".encode()).hexdigest()
+
+
+def _fingerprint(scope, body: bytes) -> str:
+    digest = hashlib.sha256()
+    digest.update(scope["method"].encode())
+    digest.update(b"\x00")
+    digest.update(scope["path"].encode())
+    digest.update(b"\x00")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+class IdempotencyMiddleware:
+    """
+    Replays the stored response for POST requests that repeat an
+    `Idempotency-Key` header, instead of running the handler again.
+
+    Only successful (2xx) responses are stored; anything else releases the
+    key so the client can retry.
+    """
+
+    def __init__(self, app, paths: Iterable[str] = IDEMPOTENT_ROUTES):
+        self.app = app
+        self.paths = tuple(paths)
+
+    def _applies(self, scope) -> bool:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return False
+        path = scope["path"]
+        return any(path == p or (p.endswith("/") and path.startswith(p)) for p in self.paths)
+
+    async def __call__(self, scope, receive, send):
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        key = headers.get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        record_id = _record_id(key, _caller(headers))
+        fingerprint = _fingerprint(scope, body)
+        store = collections["idempotency_keys"]
+
+        record = await store.find_one({"_id": record_id})
+        if record is None:
+            try:
+                await store.insert_one({
+                    "_id": record_id,
+                    "fingerprint": fingerprint,
+                    "state": "pending",
+                    "created_at": datetime.utcnow(),
+                })
+            except DuplicateKeyError:
+                record = await store.find_one({"_id": record_id})
+        elif record["state"] == "pending" and record["fingerprint"] == fingerprint:
+            stale_before = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS)
+            if record["created_at"] < stale_before:
+                taken = await store.update_one(
+                    {"_id": record_id, "state": "pending", "created_at": record["created_at"]},
+                    {"$set": {"created_at": datetime.utcnow()}},
+                )
+                if taken.modified_count:
+                    record = None
+
+        if record is not None:
+            await self._replay(record, fingerprint, scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": None, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [k.decode("latin-1"), v.decode("latin-1")] for k, v in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except Exception:
+            await store.delete_one({"_id": record_id})
+            raise
+
+        if response["status"] is not None and 200 <= response["status"] < 300:
+            await store.update_one(
+                {"_id": record_id},
+                {"$set": {
+                    "state": "done",
+                    "status_code": response["status"],
+                    "headers": response["headers"],
+                    "body": b"".join(response["body"]),
+                }},
+            )
+        else:
+            await store.delete_one({"_id": record_id})
+
+    async def _replay(self, record, fingerprint, scope, receive, send):
+        if record["fingerprint"] != fingerprint:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used for a different request"},
+                status_code=422,
+            )
+        elif record["state"] != "done":
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is still being processed"},
+                status_code=409,
+            )
+        else:
+            headers = [
+                (k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]
+            ]
+            headers.append((b"idempotent-replayed", b"true"))
+            await send({"type": "http.response.start", "status": record["status_code"], "headers": headers})
+            await send({"type": "http.response.body", "body": bytes(record["body"])})
+            return
+        await response(scope, receive, send)
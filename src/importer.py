@@ -0,0 +1,347 @@
+"""
+Streaming bulk import of patients and catalog entries from CSV or NDJSON.
+
+Offline usage:
+
+    python -m src.importer patients patients.csv
+    python -m src.importer medicine medicines.ndjson --chunk-size 2000
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import BulkWriteError
+
+from .auth import hash_password
+from .database import collections
+from .expiry import expiry_index
+from .patient_index import patient_index
+from .schema import Allergy, Condition, MedicalHistory, Medicine, Person, RoleEnum, Surgery
+from . import versions
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 1000))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", os.cpu_count() or 1))
+MAX_REPORTED_ERRORS = 100
+DUPLICATE_KEY = 11000
+
+CATALOG_MODELS = {
+    "medicine": Medicine,
+    "allergy": Allergy,
+    "condition": Condition,
+    "surgery": Surgery,
+}
+IMPORTABLE = ("patients",) + tuple(CATALOG_MODELS)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+class ImportReport(BaseModel):
+    entity: str
+    rows: int = 0
+    inserted: int = 0
+    rejected: int = 0
+    errors: List[dict] = []
+    seconds: float = 0.0
+    rows_per_second: float = 0.0
+
+
+def _hash_passwords(passwords: List[str]) -> List[str]:
+    return [hash_password(password) for password in passwords]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMPORT_HASH_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """
+    bcrypt is deliberately slow; spread a chunk over the process pool so it
+    neither blocks the event loop nor runs on a single core.
+    """
+    if not passwords:
+        return []
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    step = max(1, -(-len(passwords) // IMPORT_HASH_WORKERS))
+    parts = await asyncio.gather(*[
+        loop.run_in_executor(pool, _hash_passwords, passwords[i:i + step])
+        for i in range(0, len(passwords), step)
+    ])
+    return [hashed for part in parts for hashed in part]
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+
+def _nest(flat: Dict[str, str]) -> dict:
+    """
+    Turn dotted CSV headers (`contact_details.email`) into nested fields and
+    drop empty cells so they fall back to model defaults.
+    """
+    row: dict = {}
+    for key, value in flat.items():
+        if value is None or value == "":
+            continue
+        target = row
+        *parents, leaf = key.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[leaf] = value
+    return row
+
+
+async def parse_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[dict]:
+    """
+    Yields one dict per record. CSV records must fit on a single line.
+    Unparseable records are yielded as the exception, so they are reported
+    against their row instead of aborting the import.
+    """
+    if fmt == "ndjson":
+        async for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON: {e}")
+                continue
+            yield row if isinstance(row, dict) else ValueError("Expected a JSON object")
+        return
+    if fmt != "csv":
+        raise ValueError(f"Unsupported import format: {fmt}")
+    header = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        yield _nest(dict(zip(header, values)))
+
+
+async def _chunks(rows: AsyncIterator[dict], size: int):
+    chunk = []
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _reject(report: ImportReport, row_number: int, error):
+    report.rejected += 1
+    if len(report.errors) < MAX_REPORTED_ERRORS:
+        report.errors.append({"row": row_number, "error": str(error)})
+
+
+async def _insert_rows(name: str, docs: List[dict], rows: List[int], report: ImportReport) -> set:
+    """
+    insert_many that reports rejected documents against their source rows
+    instead of failing the import. Returns the positions that failed.
+    """
+    try:
+        await collections[name].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = set()
+        for error in e.details.get("writeErrors", []):
+            failed.add(error["index"])
+            duplicate = error.get("code") == DUPLICATE_KEY and name == "persons"
+            _reject(report, rows[error["index"]], "Username already exists" if duplicate else error.get("errmsg"))
+        return failed
+    return set()
+
+
+async def _import_patients(chunk: List[dict], first_row: int, report: ImportReport):
+    candidates = []
+    seen = set()
+    for offset, row in enumerate(chunk):
+        row_number = first_row + offset
+        if isinstance(row, Exception):
+            _reject(report, row_number, row)
+            continue
+        row["role"] = RoleEnum.PATIENT
+        try:
+            person = Person(**row)
+        except ValidationError as e:
+            _reject(report, row_number, e)
+            continue
+        if not person.username or not person.password:
+            _reject(report, row_number, "username and password are required")
+            continue
+        if person.username in seen:
+            _reject(report, row_number, "Username already exists")
+            continue
+        seen.add(person.username)
+        candidates.append((row_number, person))
+
+    existing = set()
+    if seen:
+        cursor = collections["persons"].find({"username": {"$in": list(seen)}}, {"username": 1})
+        existing = {doc["username"] async for doc in cursor}
+
+    accepted = []
+    for row_number, person in candidates:
+        if person.username in existing:
+            _reject(report, row_number, "Username already exists")
+        else:
+            accepted.append((row_number, person))
+    if not accepted:
+        return
+    people = [person for _, person in accepted]
+
+    hashed = await hash_passwords([person.password for person in people])
+    rows, person_docs = [], []
+    for (row_number, person), password in zip(accepted, hashed):
+        user_dict = person.dict(by_alias=True)
+        user_dict["uuid"] = str(uuid.uuid4())
+        user_dict["password"] = password
+        user_dict["updated_at"] = datetime.utcnow()
+        rows.append(row_number)
+        person_docs.append(user_dict)
+
+    # A concurrent signup can still take a username between the check
+    # above and the insert; the unique index turns that into a per-row error.
+    failed = await _insert_rows("persons", person_docs, rows, report)
+    rows = [row for i, row in enumerate(rows) if i not in failed]
+    person_docs = [doc for i, doc in enumerate(person_docs) if i not in failed]
+    if not person_docs:
+        return
+
+    history_docs = [MedicalHistory(patient_id=doc["uuid"]).dict(by_alias=True) for doc in person_docs]
+    failed = await _insert_rows("medical_history", history_docs, rows, report)
+    if failed:
+        # A patient without a medical history can't be charted; take them back out.
+        await collections["persons"].delete_many({"uuid": {"$in": [person_docs[i]["uuid"] for i in failed]}})
+        person_docs = [doc for i, doc in enumerate(person_docs) if i not in failed]
+    for user_dict in person_docs:
+        patient_index.put(user_dict)
+    report.inserted += len(person_docs)
+
+
+async def _import_catalog(entity: str, chunk: List[dict], first_row: int, report: ImportReport):
+    model = CATALOG_MODELS[entity]
+    rows, docs = [], []
+    for offset, row in enumerate(chunk):
+        if isinstance(row, Exception):
+            _reject(report, first_row + offset, row)
+            continue
+        try:
+            docs.append(model(**row).dict(by_alias=True))
+        except ValidationError as e:
+            _reject(report, first_row + offset, e)
+            continue
+        rows.append(first_row + offset)
+    if not docs:
+        return
+    # Re-importing an export repeats its _ids; those rows are rejected.
+    failed = await _insert_rows(entity, docs, rows, report)
+    docs = [doc for i, doc in enumerate(docs) if i not in failed]
+    report.inserted += len(docs)
+    if entity == "medicine":
+        expiry_index.apply(docs)
+
+
+async def import_stream(
+    entity: str,
+    chunks: AsyncIterator[bytes],
+    fmt: str = "csv",
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> ImportReport:
+    """
+    Parse, validate and insert `chunk_size` rows at a time, so memory stays
+    flat regardless of the size of the upload.
+    """
+    if entity not in IMPORTABLE:
+        raise ValueError(f"Cannot import {entity}")
+    report = ImportReport(entity=entity)
+    started = time.perf_counter()
+    rows = parse_rows(iter_lines(chunks), fmt)
+    try:
+        async for chunk in _chunks(rows, chunk_size):
+            first_row = report.rows + 1
+            report.rows += len(chunk)
+            if entity == "patients":
+                await _import_patients(chunk, first_row, report)
+            else:
+                await _import_catalog(entity, chunk, first_row, report)
+    finally:
+        if report.inserted:
+            if entity == "patients":
+                versions.bump("persons", "medical_history")
+            else:
+                versions.bump(entity)
+        report.errors.sort(key=lambda error: error["row"])
+        report.seconds = round(time.perf_counter() - started, 3)
+        report.rows_per_second = round(report.rows / report.seconds, 1) if report.seconds else 0.0
+    return report
+
+
+async def _read_file(path: str, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _format_for(path: str) -> str:
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+async def _main(args):
+    try:
+        report = await import_stream(
+            args.entity,
+            _read_file(args.path),
+            fmt=args.format or _format_for(args.path),
+            chunk_size=args.chunk_size,
+        )
+    finally:
+        shutdown_pool()
+        await versions.flush()
+    print(json.dumps(report.dict(), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import patients or catalog entries.")
+    parser.add_argument("entity", choices=IMPORTABLE)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "ndjson"))
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    asyncio.run(_main(parser.parse_args()))
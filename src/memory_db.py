@@ -0,0 +1,647 @@
+"""
+In-process stand-in for the Motor client, selected with
+DATABASE_BACKEND=memory (see database.py).
+
+It implements the subset of the collection API this app uses, with the
+same result and error types as pymongo:
+
+    find (sort/skip/limit, async iteration, to_list), find_one,
+    find_one_and_update, find_one_and_delete, insert_one, insert_many,
+    update_one, update_many, delete_one, delete_many, bulk_write,
+    create_index, drop, rename
+
+Filters support equality (including array membership and null matching
+missing fields), dotted paths, $eq $ne $gt $gte $lt $lte $in $nin
+$exists and $and/$or/$nor. Updates support $set $unset $inc $min $max
+and $setOnInsert, with upserts. Unique indexes are enforced, TTL indexes
+expire documents (from a min-heap of expiry dates, not a scan), and the
+first field of every index is kept as a hash index for equality
+lookups. Data lives in the process and is lost when it exits.
+"""
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+DUPLICATE_KEY = 11000
+TTL_CHECK_SECONDS = 1.0
+_MISSING = object()
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        # BSON dates are UTC and come back naive, as from a real server.
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _get(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _set(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _unset(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def _compare(a, b, op) -> bool:
+    if a is _MISSING or a is None or b is None:
+        return False
+    try:
+        return op(a, b)
+    except TypeError:
+        return False
+
+
+def _equals(value, expected) -> bool:
+    if expected is None:
+        return value is _MISSING or value is None
+    if value is _MISSING:
+        return False
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _match_condition(value, condition) -> bool:
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        return _equals(value, condition)
+    for op, arg in condition.items():
+        if op == "$eq":
+            ok = _equals(value, arg)
+        elif op == "$ne":
+            ok = not _equals(value, arg)
+        elif op == "$gt":
+            ok = _compare(value, arg, lambda a, b: a > b)
+        elif op == "$gte":
+            ok = _compare(value, arg, lambda a, b: a >= b)
+        elif op == "$lt":
+            ok = _compare(value, arg, lambda a, b: a < b)
+        elif op == "$lte":
+            ok = _compare(value, arg, lambda a, b: a <= b)
+        elif op == "$in":
+            ok = any(_equals(value, item) for item in arg)
+        elif op == "$nin":
+            ok = not any(_equals(value, item) for item in arg)
+        elif op == "$exists":
+            ok = (value is not _MISSING) == bool(arg)
+        else:
+            raise OperationFailure(f"unknown operator: {op}")
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            ok = all(matches(doc, q) for q in condition)
+        elif key == "$or":
+            ok = any(matches(doc, q) for q in condition)
+        elif key == "$nor":
+            ok = not any(matches(doc, q) for q in condition)
+        else:
+            ok = _match_condition(_get(doc, key), condition)
+        if not ok:
+            return False
+    return True
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return _copy(doc)
+    include = [k for k, v in projection.items() if v and k != "_id"]
+    if include:
+        projected = {}
+        for key in include:
+            value = _get(doc, key)
+            if value is not _MISSING:
+                _set(projected, key, _copy(value))
+        if projection.get("_id", 1) and "_id" in doc:
+            projected["_id"] = doc["_id"]
+        return projected
+    projected = _copy(doc)
+    for key, value in projection.items():
+        if not value:
+            _unset(projected, key)
+    return projected
+
+
+def _sort_key(value):
+    # Missing and null sort first, as in MongoDB.
+    if value is _MISSING or value is None:
+        return (0, 0)
+    return (1, value)
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool = False):
+    if not any(key.startswith("$") for key in update):
+        raise OperationFailure("update only works with $ operators")
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            current = _get(doc, path)
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                _set(doc, path, _copy(arg))
+            elif op == "$setOnInsert":
+                continue
+            elif op == "$unset":
+                _unset(doc, path)
+            elif op == "$inc":
+                _set(doc, path, (0 if current is _MISSING else current) + arg)
+            elif op == "$max":
+                if current is _MISSING or current is None or _compare(arg, current, lambda a, b: a > b):
+                    _set(doc, path, arg)
+            elif op == "$min":
+                if current is _MISSING or current is None or _compare(arg, current, lambda a, b: a < b):
+                    _set(doc, path, arg)
+            else:
+                raise OperationFailure(f"unknown update operator: {op}")
+
+
+def _upsert_seed(query: dict) -> dict:
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set(doc, key, _copy(condition["$eq"]))
+            continue
+        _set(doc, key, _copy(condition))
+    return doc
+
+
+def _hashable(value):
+    if value is _MISSING:
+        return None
+    try:
+        hash(value)
+    except TypeError:
+        return _MISSING
+    return value
+
+
+def _lookup_values(condition) -> Optional[list]:
+    """
+    Values a hash index can look up for `condition` (plain equality or
+    $in over hashable values), or None when it needs a scan.
+    """
+    if condition is _MISSING:
+        return None
+    if isinstance(condition, dict):
+        if list(condition) != ["$in"]:
+            return None
+        values = list(condition["$in"])
+    else:
+        values = [condition]
+    if any(_hashable(value) is _MISSING for value in values):
+        return None
+    return values
+
+
+def _sorted(docs: List[dict], sort) -> List[dict]:
+    if isinstance(sort, str):
+        sort = [(sort, 1)]
+    for field, direction in reversed(list(sort or [])):
+        docs.sort(key=lambda doc: _sort_key(_get(doc, field)), reverse=direction < 0)
+    return docs
+
+
+class MemoryIndex:
+    def __init__(self, name: str, keys: List[tuple], unique: bool, ttl: Optional[float], partial: Optional[dict]):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.unique = unique
+        self.ttl = ttl
+        self.partial = partial
+        # first field value -> _ids; unhashable values (arrays) are kept
+        # under _MISSING and returned for every lookup.
+        self.lookup: Dict[Any, set] = {}
+        # TTL indexes: min-heap of (date, push order, _id). Entries are not
+        # removed when a document changes or goes; expiry skips any whose
+        # document no longer has that date.
+        self.expiry: List[tuple] = []
+        self._pushes = itertools.count()
+
+    def covers(self, doc: dict) -> bool:
+        return self.partial is None or matches(doc, self.partial)
+
+    def add(self, doc: dict):
+        value = _get(doc, self.fields[0])
+        self.lookup.setdefault(_hashable(value), set()).add(doc["_id"])
+        if self.ttl is not None and isinstance(value, datetime):
+            heapq.heappush(self.expiry, (value, next(self._pushes), doc["_id"]))
+
+    def remove(self, doc: dict):
+        ids = self.lookup.get(_hashable(_get(doc, self.fields[0])))
+        if ids is not None:
+            ids.discard(doc["_id"])
+
+    def key_of(self, doc: dict) -> tuple:
+        return tuple(_hashable(_get(doc, field)) for field in self.fields)
+
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query: Optional[dict], projection: Optional[dict]):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort: List[tuple] = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction or 1)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def _evaluate(self) -> List[dict]:
+        docs = _sorted(self._collection._matching(self._query), self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(doc, self._projection) for doc in docs]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            self._results = iter(self._evaluate())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._evaluate() if self._results is None else list(self._results)
+        self._results = iter(())
+        return results if length is None else results[:length]
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        # _id -> insertion sequence, the "natural order" of a scan.
+        self._order: Dict[Any, int] = {}
+        self._sequence = 0
+        self._indexes: Dict[str, MemoryIndex] = {}
+        self._next_ttl_check = 0.0
+
+    # -- indexes ----------------------------------------------------------
+
+    async def create_index(self, keys, unique: bool = False, expireAfterSeconds: Optional[float] = None,
+                           partialFilterExpression: Optional[dict] = None, name: Optional[str] = None, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        if name in self._indexes:
+            return name
+        index = MemoryIndex(name, keys, unique, expireAfterSeconds, partialFilterExpression)
+        for doc in self._docs.values():
+            if index.covers(doc):
+                index.add(doc)
+        if unique:
+            seen = set()
+            for doc in self._docs.values():
+                if index.covers(doc):
+                    key = index.key_of(doc)
+                    if key in seen:
+                        raise DuplicateKeyError(f"E11000 duplicate key error index: {name}", DUPLICATE_KEY)
+                    seen.add(key)
+        self._indexes[name] = index
+        return name
+
+    def _check_unique(self, doc: dict, ignore_id=None):
+        if doc["_id"] in self._docs and doc["_id"] != ignore_id:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_",
+                                    DUPLICATE_KEY, {"keyValue": {"_id": doc["_id"]}})
+        for index in self._indexes.values():
+            if not index.unique or not index.covers(doc):
+                continue
+            key = index.key_of(doc)
+            for other_id in self._candidates_for(index, key[0]):
+                other = self._docs[other_id]
+                if other_id != ignore_id and index.covers(other) and index.key_of(other) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {index.name}",
+                                            DUPLICATE_KEY, {"keyValue": dict(zip(index.fields, key))})
+
+    def _candidates_for(self, index: MemoryIndex, value) -> Iterable:
+        return set(index.lookup.get(value, ())) | set(index.lookup.get(_MISSING, ()))
+
+    def _store(self, doc: dict):
+        self._docs[doc["_id"]] = doc
+        if doc["_id"] not in self._order:
+            self._sequence += 1
+            self._order[doc["_id"]] = self._sequence
+        for index in self._indexes.values():
+            if index.covers(doc):
+                index.add(doc)
+
+    def _unindex(self, doc: dict):
+        for index in self._indexes.values():
+            index.remove(doc)
+
+    def _drop(self, doc: dict):
+        del self._docs[doc["_id"]]
+        del self._order[doc["_id"]]
+        self._unindex(doc)
+
+    def _expire(self):
+        now = time.monotonic()
+        if now < self._next_ttl_check:
+            return
+        self._next_ttl_check = now + TTL_CHECK_SECONDS
+        for index in self._indexes.values():
+            if index.ttl is None:
+                continue
+            cutoff = datetime.utcnow() - timedelta(seconds=index.ttl)
+            heap = index.expiry
+            while heap and heap[0][0] < cutoff:
+                value, _, doc_id = heapq.heappop(heap)
+                doc = self._docs.get(doc_id)
+                if doc is not None and index.covers(doc) and _get(doc, index.fields[0]) == value:
+                    self._drop(doc)
+            if len(heap) > 2 * len(self._docs) + 1024:
+                # Mostly stale entries from updates; start over from the documents.
+                index.expiry = []
+                for doc in self._docs.values():
+                    if index.covers(doc):
+                        index.add(doc)
+
+    # -- matching ---------------------------------------------------------
+
+    def _matching(self, query: Optional[dict], limit: int = 0) -> List[dict]:
+        self._expire()
+        query = query or {}
+        candidates = None
+        values = _lookup_values(query.get("_id", _MISSING))
+        if values is not None:
+            candidates = [self._docs[value] for value in dict.fromkeys(values) if value in self._docs]
+        else:
+            for index in self._indexes.values():
+                values = _lookup_values(query.get(index.fields[0], _MISSING))
+                if index.partial is None and values is not None:
+                    ids = set().union(*(self._candidates_for(index, value) for value in values))
+                    candidates = [self._docs[doc_id] for doc_id in sorted(ids, key=self._order.__getitem__)]
+                    break
+        if candidates is None:
+            candidates = self._docs.values()
+        found = []
+        for doc in candidates:
+            if matches(doc, query):
+                found.append(doc)
+                if limit and len(found) >= limit:
+                    break
+        return found
+
+    def _first(self, query: Optional[dict], sort=None) -> Optional[dict]:
+        docs = _sorted(self._matching(query), sort) if sort else self._matching(query, limit=1)
+        return docs[0] if docs else None
+
+    # -- reads ------------------------------------------------------------
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("skip"):
+            cursor.skip(kwargs["skip"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> Optional[dict]:
+        doc = self._first(filter, kwargs.get("sort"))
+        return _project(doc, projection) if doc is not None else None
+
+    async def count_documents(self, filter: dict, **kwargs) -> int:
+        return len(self._matching(filter))
+
+    # -- writes -----------------------------------------------------------
+
+    def _insert(self, document: dict) -> Any:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        doc = _copy(document)
+        self._check_unique(doc)
+        self._store(doc)
+        return doc["_id"]
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        inserted, errors = [], []
+        for i, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": DUPLICATE_KEY, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return InsertManyResult(inserted, True)
+
+    def _update_doc(self, doc: dict, update: dict) -> bool:
+        updated = _copy(doc)
+        _apply_update(updated, update)
+        if updated == doc:
+            return False
+        updated["_id"] = doc["_id"]
+        self._check_unique(updated, ignore_id=doc["_id"])
+        self._unindex(doc)
+        self._store(updated)
+        return True
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        doc = _upsert_seed(query)
+        _apply_update(doc, update, inserting=True)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self._store(doc)
+        return doc
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool) -> dict:
+        docs = self._matching(query, limit=0 if many else 1)
+        if not docs and upsert:
+            doc = self._upsert(query, update)
+            return {"n": 1, "nModified": 0, "upserted": doc["_id"]}
+        modified = sum(self._update_doc(doc, update) for doc in docs)
+        return {"n": len(docs), "nModified": modified}
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, many=False), True)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, many=True), True)
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None,
+                                  sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE, **kwargs) -> Optional[dict]:
+        doc = self._first(filter, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = self._upsert(filter, update)
+            return _project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        before = _project(doc, projection)
+        self._update_doc(doc, update)
+        if return_document == ReturnDocument.AFTER:
+            return _project(self._docs[doc["_id"]], projection)
+        return before
+
+    def _delete(self, query: dict, many: bool) -> int:
+        docs = self._matching(query, limit=0 if many else 1)
+        for doc in docs:
+            self._drop(doc)
+        return len(docs)
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=False)}, True)
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=True)}, True)
+
+    async def find_one_and_delete(self, filter: dict, projection: Optional[dict] = None, sort=None,
+                                  **kwargs) -> Optional[dict]:
+        doc = self._first(filter, sort)
+        if doc is None:
+            return None
+        self._drop(doc)
+        return _project(doc, projection)
+
+    async def drop(self, **kwargs):
+        self._docs, self._order, self._sequence, self._indexes = {}, {}, 0, {}
+
+    async def rename(self, new_name: str, dropTarget: bool = False, **kwargs):
+        if not self._docs:
+            raise OperationFailure("source namespace does not exist")
+        target = self.database[new_name]
+        if target._docs and not dropTarget:
+            raise OperationFailure("target namespace exists")
+        # Swap contents into the existing object, which callers hold on to.
+        target._docs, target._order, target._sequence, target._indexes = (
+            self._docs, self._order, self._sequence, self._indexes
+        )
+        await self.drop()
+
+    async def bulk_write(self, requests: List, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for i, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    outcome = self._update(request._filter, request._doc, bool(request._upsert),
+                                           many=isinstance(request, UpdateMany))
+                    if "upserted" in outcome:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": i, "_id": outcome["upserted"]})
+                    else:
+                        result["nMatched"] += outcome["n"]
+                        result["nModified"] += outcome["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result["nRemoved"] += self._delete(request._filter, many=isinstance(request, DeleteMany))
+                else:
+                    raise OperationFailure(f"unsupported bulk operation: {type(request).__name__}")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": i, "code": DUPLICATE_KEY, "errmsg": str(e)})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, command, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"command {name} is not supported by the memory backend")
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(name)
+        return database
+
+    def close(self):
+        pass
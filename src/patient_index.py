@@ -0,0 +1,294 @@
+"""
+In-memory lookup table of patient identity fields for the reception
+desk, so check-ins are served without a Mongo round trip.
+
+Each patient is one __slots__ record. Exact lookups go through uuid and
+username dicts; prefix lookups (username, name, phone) bisect a sorted
+run of lower-cased "kind:value" keys with parallel records. The run is
+split into buckets of at most 2 * BUCKET_SIZE keys, so a write shifts one
+bucket rather than the whole list.
+
+Other workers' writes are picked up by polling persons for updated_at /
+deleted_at newer than the last poll (every PATIENT_INDEX_POLL_SECONDS),
+so every path that writes a patient sets updated_at. A full rebuild
+still runs every PATIENT_INDEX_REFRESH_SECONDS; with SOFT_DELETE=0 it is
+the only way hard deletes made elsewhere are seen.
+"""
+import logging
+import os
+import sys
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from .database import collections
+from .periodic import Periodic
+from .schema import ContactDetails, Person, RoleEnum
+from .softdelete import live
+
+PATIENT_INDEX_REFRESH_SECONDS = float(os.getenv("PATIENT_INDEX_REFRESH_SECONDS", 300))
+PATIENT_INDEX_POLL_SECONDS = float(os.getenv("PATIENT_INDEX_POLL_SECONDS", 2))
+# Overlap between polls, for clock skew between workers.
+POLL_OVERLAP = timedelta(seconds=5)
+BUCKET_SIZE = 512
+
+logger = logging.getLogger(__name__)
+
+
+class PatientRecord:
+    __slots__ = (
+        "id", "uuid", "username", "name", "gender", "DOB", "email", "phone", "address",
+        "blood_group", "emergency_contact", "specialization", "working_hours",
+    )
+
+    def __init__(self, doc: dict):
+        contact = doc.get("contact_details") or {}
+        self.id = doc.get("_id")
+        self.uuid = doc.get("uuid")
+        self.username = doc.get("username")
+        self.name = doc.get("name")
+        self.gender = doc.get("gender")
+        self.DOB = doc.get("DOB")
+        self.email = contact.get("email")
+        self.phone = contact.get("phone_num")
+        self.address = contact.get("address")
+        self.blood_group = doc.get("blood_group")
+        self.emergency_contact = doc.get("emergency_contact")
+        self.specialization = doc.get("specialization")
+        self.working_hours = doc.get("working_hours")
+
+    def keys(self) -> List[str]:
+        keys = []
+        for kind, value in (("u", self.username), ("n", self.name), ("p", self.phone)):
+            if value:
+                keys.append(f"{kind}:{value.lower()}")
+        return keys
+
+    def to_person(self) -> Person:
+        contact = None
+        if self.email or self.phone or self.address:
+            contact = ContactDetails(email=self.email, phone_num=self.phone, address=self.address)
+        return Person(
+            _id=self.id, uuid=self.uuid, username=self.username, name=self.name, gender=self.gender,
+            DOB=self.DOB, contact_details=contact, blood_group=self.blood_group,
+            emergency_contact=self.emergency_contact, specialization=self.specialization,
+            working_hours=self.working_hours, role=RoleEnum.PATIENT, password=None,
+        )
+
+
+class PatientIndex:
+    def __init__(self):
+        self.ready = False
+        self._by_uuid: Dict[str, PatientRecord] = {}
+        self._by_username: Dict[str, PatientRecord] = {}
+        # Sorted keys in buckets, parallel record buckets, and the last
+        # key of each bucket for picking one.
+        self._keys: List[List[str]] = []
+        self._records: List[List[PatientRecord]] = []
+        self._maxes: List[str] = []
+        # Writes made while a rebuild is reading, replayed onto its result.
+        self._replay: Optional[list] = None
+        self._polled_at: Optional[datetime] = None
+        self._built_at: Optional[datetime] = None
+        self._refresher = Periodic("Patient index refresh", PATIENT_INDEX_POLL_SECONDS, self._refresh)
+
+    def __len__(self):
+        return len(self._by_uuid)
+
+    async def ensure_indexes(self):
+        await collections["persons"].create_index("updated_at")
+
+    async def build(self):
+        started = datetime.utcnow()
+        by_uuid, by_username, entries = {}, {}, []
+        self._replay = []
+        try:
+            cursor = collections["persons"].find(live({"role": RoleEnum.PATIENT}), {"password": 0})
+            async for doc in cursor:
+                record = PatientRecord(doc)
+                by_uuid[record.uuid] = record
+                if record.username:
+                    by_username[record.username] = record
+                entries.extend((key, record) for key in record.keys())
+            entries.sort(key=lambda entry: entry[0])
+            self._by_uuid, self._by_username = by_uuid, by_username
+            self._keys, self._records, self._maxes = [], [], []
+            for start in range(0, len(entries), BUCKET_SIZE):
+                bucket = entries[start:start + BUCKET_SIZE]
+                self._keys.append([key for key, _ in bucket])
+                self._records.append([record for _, record in bucket])
+                self._maxes.append(bucket[-1][0])
+            replay = self._replay
+        finally:
+            self._replay = None
+        # A patient deleted while the cursor was running may have been read
+        # before the delete; apply what happened meanwhile on top.
+        for op, arg in replay:
+            getattr(self, op)(arg)
+        self._polled_at = started
+        self._built_at = datetime.utcnow()
+        self.ready = True
+
+    async def poll(self):
+        """
+        Apply patients written or deleted (by any worker) since the last
+        poll.
+        """
+        if self._polled_at is None:
+            return
+        started = datetime.utcnow()
+        since = self._polled_at - POLL_OVERLAP
+        query = {"$or": [{"updated_at": {"$gt": since}}, {"deleted_at": {"$gt": since}}]}
+        async for doc in collections["persons"].find(query, {"password": 0}):
+            if doc.get("deleted_at") is None and doc.get("role") == RoleEnum.PATIENT:
+                self.put(doc)
+            else:
+                self.remove(doc.get("uuid"))
+        self._polled_at = started
+
+    def put(self, doc: dict):
+        """
+        Insert or replace a patient from a persons document.
+        """
+        if self._replay is not None:
+            self._replay.append(("put", doc))
+        self._discard(doc.get("uuid"))
+        record = PatientRecord(doc)
+        self._by_uuid[record.uuid] = record
+        if record.username:
+            self._by_username[record.username] = record
+        for key in record.keys():
+            self._insert(key, record)
+
+    def remove(self, uuid: Optional[str]):
+        if self._replay is not None:
+            self._replay.append(("remove", uuid))
+        self._discard(uuid)
+
+    def _discard(self, uuid: Optional[str]):
+        record = self._by_uuid.pop(uuid, None)
+        if record is None:
+            return
+        if record.username and self._by_username.get(record.username) is record:
+            del self._by_username[record.username]
+        for key in record.keys():
+            self._delete(key, record)
+
+    def _insert(self, key: str, record: PatientRecord):
+        if not self._maxes:
+            self._keys.append([key])
+            self._records.append([record])
+            self._maxes.append(key)
+            return
+        b = min(bisect_right(self._maxes, key), len(self._maxes) - 1)
+        keys, records = self._keys[b], self._records[b]
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        records.insert(i, record)
+        self._maxes[b] = keys[-1]
+        if len(keys) > 2 * BUCKET_SIZE:
+            self._keys[b:b + 1] = [keys[:BUCKET_SIZE], keys[BUCKET_SIZE:]]
+            self._records[b:b + 1] = [records[:BUCKET_SIZE], records[BUCKET_SIZE:]]
+            self._maxes[b:b + 1] = [keys[BUCKET_SIZE - 1], keys[-1]]
+
+    def _delete(self, key: str, record: PatientRecord):
+        b = bisect_left(self._maxes, key)
+        while b < len(self._maxes):
+            keys, records = self._keys[b], self._records[b]
+            i = bisect_left(keys, key)
+            while i < len(keys) and keys[i] == key:
+                if records[i] is record:
+                    del keys[i]
+                    del records[i]
+                    if keys:
+                        self._maxes[b] = keys[-1]
+                    else:
+                        del self._keys[b], self._records[b], self._maxes[b]
+                    return
+                i += 1
+            if i < len(keys):
+                return
+            b += 1
+
+    def _scan(self, start: str) -> Iterator[tuple]:
+        """
+        (key, record) pairs in key order from the first key >= `start`.
+        """
+        b = bisect_left(self._maxes, start)
+        if b == len(self._maxes):
+            return
+        i = bisect_left(self._keys[b], start)
+        for keys, records in zip(self._keys[b:], self._records[b:]):
+            for j in range(i, len(keys)):
+                yield keys[j], records[j]
+            i = 0
+
+    def get(self, uuid: Optional[str] = None, username: Optional[str] = None) -> Optional[PatientRecord]:
+        if uuid:
+            record = self._by_uuid.get(uuid)
+            if record is None or (username and record.username != username):
+                return None
+            return record
+        return self._by_username.get(username)
+
+    def search(self, prefix: str, limit: int = 20) -> List[PatientRecord]:
+        """
+        Patients whose username, name or phone starts with `prefix`
+        (case-insensitive).
+        """
+        prefix = prefix.lower()
+        found: Dict[str, PatientRecord] = {}
+        for kind in ("u", "n", "p"):
+            start = f"{kind}:{prefix}"
+            for key, record in self._scan(start):
+                if len(found) >= limit or not key.startswith(start):
+                    break
+                found.setdefault(record.uuid, record)
+        return list(found.values())[:limit]
+
+    def memory_bytes(self) -> int:
+        """
+        Approximate footprint: records, their field values, the lookup
+        dicts and the prefix buckets.
+        """
+        total = sum(sys.getsizeof(c) for c in (self._by_uuid, self._by_username, self._maxes))
+        total += sys.getsizeof(self._keys) + sys.getsizeof(self._records)
+        for keys, records in zip(self._keys, self._records):
+            total += sys.getsizeof(keys) + sys.getsizeof(records)
+            total += sum(sys.getsizeof(key) for key in keys)
+        for record in self._by_uuid.values():
+            total += sys.getsizeof(record)
+            total += sum(sys.getsizeof(getattr(record, slot)) for slot in PatientRecord.__slots__
+                         if isinstance(getattr(record, slot), str))
+        return total
+
+    def report(self) -> dict:
+        count = len(self)
+        size = self.memory_bytes()
+        per_patient = size / count if count else 0
+        return {
+            "patients": count,
+            "bytes": size,
+            "bytes_per_patient": round(per_patient, 1),
+            "mb_per_million": round(per_patient * 1_000_000 / 2 ** 20, 1),
+        }
+
+    async def start(self):
+        try:
+            await self.ensure_indexes()
+            await self.build()
+        except Exception:
+            logger.exception("Patient index build failed; reception falls back to Mongo")
+        self._refresher.start()
+
+    async def stop(self):
+        await self._refresher.stop()
+
+    async def _refresh(self):
+        if not self.ready or (datetime.utcnow() - self._built_at).total_seconds() >= PATIENT_INDEX_REFRESH_SECONDS:
+            await self.build()
+        else:
+            await self.poll()
+
+
+patient_index = PatientIndex()
@@ -0,0 +1,71 @@
+"""
+The background loop shared by the app's services: version and revocation
+syncs, the patient and expiry indexes, the audit flush, rate limit sync
+and soft delete compaction.
+
+A failing call is logged (under the logger of the module `fn` comes
+from) and retried on the next round; stop() cancels the loop and waits
+for it, so shutdown never leaves a call half-way through in the
+background.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Union
+
+
+class Periodic:
+    """
+    Awaits `fn()` every `interval` seconds in a background task. `interval`
+    may be a callable returning the next delay, for loops that wake at a
+    computed time; wake() makes the next call happen straight away.
+    """
+
+    def __init__(self, name: str, interval: Union[float, Callable[[], float]], fn: Callable[[], Awaitable]):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._logger = logging.getLogger(fn.__module__)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, immediately: bool = False):
+        """
+        Start the loop; the first call is after one interval unless
+        `immediately`.
+        """
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(immediately))
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sleep(self):
+        delay = self.interval() if callable(self.interval) else self.interval
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run(self, immediately: bool):
+        if not immediately:
+            await self._sleep()
+        while True:
+            try:
+                await self.fn()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.exception("%s failed", self.name)
+            await self._sleep()
@@ -0,0 +1,201 @@
+"""
+Opt-in slow query profiler for the Motor client.
+
+Enable with MONGO_PROFILE=1; commands slower than MONGO_SLOW_MS are
+grouped by route, command, collection and redacted filter shape. Shapes
+that keep showing up get one `explain` sampled so COLLSCANs stand out.
+When disabled nothing is registered on the client.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from fastapi import Depends, Request
+from pymongo import monitoring
+
+ENABLED = os.getenv("MONGO_PROFILE", "0") == "1"
+MONGO_SLOW_MS = float(os.getenv("MONGO_SLOW_MS", 100))
+EXPLAIN_AFTER = int(os.getenv("MONGO_EXPLAIN_AFTER", 3))
+MAX_SHAPES = 1000
+
+# Commands whose plans are worth looking at -> key holding the filter.
+FILTER_KEYS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "delete": "deletes",
+    "update": "updates",
+    "aggregate": "pipeline",
+}
+IGNORED_COMMANDS = {"explain", "hello", "isMaster", "ismaster", "ping", "endSessions", "saslStart", "saslContinue"}
+# Session/driver fields that must not be sent inside an explain.
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction"}
+
+current_route: ContextVar[Optional[str]] = ContextVar("current_route", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+def redact(value):
+    """
+    Keep the structure and operators of a filter, replace values by their
+    type so no PHI ends up in the report.
+    """
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = redact(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return type(value).__name__
+
+
+def _filter_of(command_name: str, command: dict):
+    value = command.get(FILTER_KEYS.get(command_name, ""))
+    if command_name in ("delete", "update") and value:
+        return value[0].get("q")
+    if command_name == "aggregate" and value:
+        return [stage for stage in value if "$match" in stage]
+    return value
+
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("inputStage", "queryPlan"):
+            stages.extend(_plan_stages(plan.get(key)))
+        for child in plan.get("inputStages", []):
+            stages.extend(_plan_stages(child))
+    return stages
+
+
+def summarize_plan(explain: dict) -> dict:
+    planner = explain.get("queryPlanner", {})
+    stages = _plan_stages(planner.get("winningPlan", {}))
+    return {"stages": stages, "collscan": "COLLSCAN" in stages}
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+    Runs on the driver's executor threads; Motor copies the caller's
+    context there, so `current_route` still names the originating route.
+    """
+
+    def __init__(self, slow_ms: float = MONGO_SLOW_MS):
+        self.slow_ms = slow_ms
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client = None
+        self._pending: Dict[tuple, tuple] = {}
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        self._pending[(event.connection_id, event.request_id)] = (current_route.get(), event.command)
+
+    def succeeded(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        elapsed_ms = event.duration_micros / 1000
+        if elapsed_ms >= self.slow_ms:
+            self._record(pending[0], event.command_name, event.database_name, pending[1], elapsed_ms)
+
+    def failed(self, event):
+        self._pending.pop((event.connection_id, event.request_id), None)
+
+    def _record(self, route, command_name, database_name, command, elapsed_ms):
+        collection = command.get(command_name)
+        shape = redact(_filter_of(command_name, command))
+        key = json.dumps([route, command_name, collection, shape], sort_keys=True, default=str)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= MAX_SHAPES:
+                    return
+                stats = self._stats[key] = {
+                    "route": route,
+                    "command": command_name,
+                    "collection": collection,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "last_seen": None,
+                    "plan": None,
+                }
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["last_seen"] = time.time()
+            explain_now = (
+                stats["plan"] is None and stats["count"] >= EXPLAIN_AFTER
+                and command_name in FILTER_KEYS and self.loop is not None
+            )
+            if explain_now:
+                stats["plan"] = "pending"
+        if explain_now:
+            asyncio.run_coroutine_threadsafe(self._explain(key, database_name, command_name, command), self.loop)
+
+    async def _explain(self, key, database_name, command_name, command):
+        body = {k: v for k, v in command.items() if not k.startswith("$") and k not in DRIVER_FIELDS}
+        try:
+            explain = await self.client[database_name].command(
+                {"explain": body, "verbosity": "queryPlanner"}
+            )
+            plan = summarize_plan(explain)
+        except Exception as e:
+            logger.warning("explain failed for slow %s: %s", command_name, e)
+            plan = {"error": str(e)}
+        with self._lock:
+            if key in self._stats:
+                self._stats[key]["plan"] = plan
+
+    def top(self, limit: int = 20) -> List[dict]:
+        with self._lock:
+            stats = [dict(s) for s in self._stats.values()]
+        for s in stats:
+            s["avg_ms"] = round(s["total_ms"] / s["count"], 2)
+            s["total_ms"] = round(s["total_ms"], 2)
+        return sorted(stats, key=lambda s: s["total_ms"], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+listener = SlowQueryListener() if ENABLED else None
+
+
+def event_listeners() -> list:
+    return [listener] if listener else []
+
+
+def attach(client):
+    """
+    Give the listener the running loop and client it needs for explains.
+    """
+    if listener:
+        listener.loop = asyncio.get_running_loop()
+        listener.client = client
+
+
+async def track_route(request: Request):
+    route = request.scope.get("route")
+    current_route.set(f"{request.method} {getattr(route, 'path', request.url.path)}")
+
+
+def route_dependencies() -> list:
+    return [Depends(track_route)] if listener else []
@@ -0,0 +1,252 @@
+"""
+Admission control: per-user token buckets plus per-route-class
+concurrency caps, applied to every route as an app dependency.
+
+Each request costs tokens by route class (a list scan costs more than a
+single-record read); callers are keyed by user uuid, or by client address
+when anonymous, and refill at the rate of their role. A class already
+running its maximum number of requests in this worker is turned away
+with 503 instead of queueing. Settings, all optional:
+
+    RATE_LIMITS="patient=60:1,doctor=200:5"   burst:refill-per-second by role
+    RATE_LIMIT_COSTS="list=10,bulk=50"        tokens per request by class
+    ADMISSION_LIMITS="list=8,bulk=2"          concurrent requests by class
+    RATE_LIMIT_SHARED=1                       share spending across workers
+    RATE_LIMIT_TRUSTED_PROXIES="10.0.0.5"     proxies whose X-Forwarded-For is used
+
+Anonymous callers are keyed by client address, except on /login (keyed
+by the username tried) and /token/refresh (keyed by the user the refresh
+token was issued to), so everyone behind one NAT does not share a bucket
+for signing in.
+"""
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi import Depends, HTTPException, Request
+from jose import JWTError, jwt
+from pymongo import ReturnDocument
+
+from .auth import ALGORITHM, SECRET_KEY, get_current_user
+from .database import collections
+from .periodic import Periodic
+from .schema import Person, RoleEnum
+
+ANONYMOUS = "anonymous"
+
+DEFAULT_LIMITS = {
+    ANONYMOUS: (30, 0.5),
+    RoleEnum.PATIENT.value: (60, 1),
+    RoleEnum.RECEPTIONIST.value: (200, 5),
+    RoleEnum.DOCTOR.value: (200, 5),
+    RoleEnum.ADMIN.value: (500, 10),
+}
+DEFAULT_COSTS = {"read": 1, "write": 2, "chart": 5, "stream": 5, "list": 10, "bulk": 50}
+# None means uncapped; clinical reads and writes are never turned away
+# because of list traffic.
+DEFAULT_CONCURRENCY = {"read": None, "write": None, "chart": 32, "stream": None, "list": 8, "bulk": 2}
+
+# "METHOD path" -> route class, where the rules in route_class() guess wrong.
+ROUTE_CLASSES = {
+    "GET /receive-patient": "read",
+    "GET /medicine/expiring": "read",
+    "GET /patients/{uuid}": "chart",
+    "GET /patients/{uuid}/events": "stream",
+    "GET /doctors/{uuid}/patients": "list",
+    "POST /import/{entity}": "bulk",
+    "POST /admin/archive": "bulk",
+    "POST /login": "write",
+    "POST /signup": "write",
+    "POST /token/refresh": "write",
+    "POST /logout": "write",
+}
+
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "0") == "1"
+RATE_LIMIT_SYNC_SECONDS = float(os.getenv("RATE_LIMIT_SYNC_SECONDS", 2))
+IDLE_BUCKET_SECONDS = 600
+TRUSTED_PROXIES = {
+    address.strip() for address in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if address.strip()
+}
+
+
+def _parse(setting: Optional[str], convert) -> dict:
+    parsed = {}
+    for item in (setting or "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            parsed[key.strip()] = convert(value.strip())
+    return parsed
+
+
+def _limit(value: str) -> tuple:
+    burst, rate = value.split(":")
+    return float(burst), float(rate)
+
+
+def _cap(value: str) -> Optional[int]:
+    return None if value.lower() in ("", "none") else int(value)
+
+
+ROLE_LIMITS = {**DEFAULT_LIMITS, **_parse(os.getenv("RATE_LIMITS"), _limit)}
+ROUTE_COSTS = {**DEFAULT_COSTS, **_parse(os.getenv("RATE_LIMIT_COSTS"), float)}
+ROUTE_CONCURRENCY = {**DEFAULT_CONCURRENCY, **_parse(os.getenv("ADMISSION_LIMITS"), _cap)}
+
+
+def route_class(method: str, path: str) -> str:
+    explicit = ROUTE_CLASSES.get(f"{method} {path}")
+    if explicit:
+        return explicit
+    if path.endswith("/bulk"):
+        return "bulk"
+    if method != "GET":
+        return "write"
+    # A GET without a path parameter returns a collection.
+    return "read" if "{" in path else "list"
+
+
+class Bucket:
+    __slots__ = ("tokens", "updated", "spent")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+        # Spent since the last shared-state sync.
+        self.spent = 0.0
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, tuple] = ROLE_LIMITS, costs: Dict[str, float] = ROUTE_COSTS,
+                 concurrency: Dict[str, Optional[int]] = ROUTE_CONCURRENCY, shared: bool = RATE_LIMIT_SHARED):
+        self.limits = limits
+        self.costs = costs
+        self.concurrency = concurrency
+        self.shared = shared
+        self._buckets: Dict[tuple, Bucket] = {}
+        self._running: Dict[str, int] = {}
+        # Shared spending total last seen per key.
+        self._seen: Dict[str, float] = {}
+        self._syncer = Periodic(
+            "Rate limit sync", RATE_LIMIT_SYNC_SECONDS if shared else IDLE_BUCKET_SECONDS, self._refresh
+        )
+
+    def charge(self, key: str, role: str, cost: float, now: Optional[float] = None):
+        """
+        Take `cost` tokens from the caller's bucket; 429 with Retry-After
+        when there are not enough.
+        """
+        now = time.monotonic() if now is None else now
+        burst, rate = self.limits.get(role, self.limits[ANONYMOUS])
+        bucket = self._buckets.get((key, role))
+        if bucket is None:
+            bucket = self._buckets[(key, role)] = Bucket(burst, now)
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        if bucket.tokens < cost:
+            retry_after = math.ceil((cost - bucket.tokens) / rate) if rate > 0 else 60
+            raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                                headers={"Retry-After": str(retry_after)})
+        bucket.tokens -= cost
+        bucket.spent += cost
+
+    def acquire(self, route_class: str):
+        cap = self.concurrency.get(route_class)
+        running = self._running.get(route_class, 0)
+        if cap is not None and running >= cap:
+            raise HTTPException(status_code=503, detail=f"Too many concurrent {route_class} requests",
+                                headers={"Retry-After": "1"})
+        self._running[route_class] = running + 1
+
+    def release(self, route_class: str):
+        self._running[route_class] -= 1
+
+    async def sync(self):
+        """
+        Publish what each caller spent here since the last sync and debit
+        what other workers reported, so the limit holds across workers.
+        """
+        expires_at = datetime.utcnow() + timedelta(seconds=IDLE_BUCKET_SECONDS)
+        active = [(key, bucket) for key, bucket in self._buckets.items() if bucket.spent]
+        for (key, role), bucket in active:
+            shared_key = f"{role}:{key}"
+            spent, bucket.spent = bucket.spent, 0.0
+            doc = await collections["rate_limits"].find_one_and_update(
+                {"_id": shared_key},
+                {"$inc": {"spent": spent}, "$set": {"expires_at": expires_at}},
+                upsert=True, return_document=ReturnDocument.AFTER,
+            )
+            previous = self._seen.get(shared_key, doc["spent"] - spent)
+            bucket.tokens -= doc["spent"] - previous - spent
+            self._seen[shared_key] = doc["spent"]
+
+    def prune(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        for key, bucket in list(self._buckets.items()):
+            if now - bucket.updated > IDLE_BUCKET_SECONDS and not bucket.spent:
+                del self._buckets[key]
+                self._seen.pop(f"{key[1]}:{key[0]}", None)
+
+    async def start(self):
+        if self.shared:
+            await collections["rate_limits"].create_index("expires_at", expireAfterSeconds=0)
+        self._syncer.start()
+
+    async def stop(self):
+        await self._syncer.stop()
+
+    async def _refresh(self):
+        if self.shared:
+            await self.sync()
+        self.prune()
+
+
+limiter = RateLimiter()
+
+
+def client_address(request: Request) -> str:
+    """
+    The caller's address; behind a trusted proxy, the nearest address in
+    X-Forwarded-For that is not itself a trusted proxy.
+    """
+    address = request.client.host if request.client else "unknown"
+    if address in TRUSTED_PROXIES:
+        for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+            hop = hop.strip()
+            if hop and hop not in TRUSTED_PROXIES:
+                return hop
+    return address
+
+
+async def _anonymous_key(request: Request, path: str) -> str:
+    try:
+        if path == "/login":
+            username = (await request.form()).get("username")
+            if username:
+                return f"login:{username.lower()}"
+        elif path == "/token/refresh":
+            token = json.loads(await request.body()).get("refresh_token")
+            # Verified, so a forged claim cannot drain someone else's bucket.
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            if claims.get("uuid"):
+                return f"refresh:{claims['uuid']}"
+    except (JWTError, ValueError, TypeError, AttributeError):
+        pass
+    return client_address(request)
+
+
+async def admit(request: Request, current_user: Optional[Person] = Depends(get_current_user)):
+    route = request.scope.get("route")
+    path = getattr(route, "path", request.url.path)
+    kind = route_class(request.method, path)
+    if current_user is not None and current_user.uuid:
+        key, role = current_user.uuid, current_user.role.value if current_user.role else ANONYMOUS
+    else:
+        key, role = await _anonymous_key(request, path), ANONYMOUS
+    limiter.charge(key, role, limiter.costs.get(kind, 1))
+    limiter.acquire(kind)
+    try:
+        yield
+    finally:
+        limiter.release(kind)
@@ -1,9 +1,9 @@
 from typing import Dict
-from schema import (
+from .schema import (
     Medicine, Medication, Allergy, AllergyDiagnosis, Condition, ConditionDiagnosis,
     Surgery, PastSurgery, MedicalHistory, Insurance, ContactDetails, Person
 )
-from database import collections
+from .database import collections
 
 registry: Dict[str, dict] = {
     "persons": {"model": Person, "collection": collections["persons"]},
@@ -0,0 +1,98 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from .database import collections
+from .periodic import Periodic
+
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 5))
+# Re-read this much history on every sync so revocations written by other
+# workers with a slightly older timestamp are not missed.
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
+def _epoch(value: datetime) -> float:
+    # Stored datetimes are naive UTC.
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RevocationList:
+    """
+    Revoked token ids and users, held in memory so the per-request check is
+    two dict lookups. Revocations are persisted to the TTL-indexed
+    revoked_tokens collection and other workers pick them up on their next
+    sync; entries expire together with the tokens they revoke.
+    """
+
+    def __init__(self, sync_seconds: float = REVOCATION_SYNC_SECONDS):
+        self.sync_seconds = sync_seconds
+        # jti -> token expiry (epoch seconds)
+        self._tokens: Dict[str, float] = {}
+        # user uuid -> (tokens issued at or before this time are revoked, entry expiry)
+        self._users: Dict[str, tuple] = {}
+        self._last_sync: Optional[datetime] = None
+        self._syncer = Periodic("Revocation sync", sync_seconds, self.sync)
+
+    def is_revoked(self, claims: dict) -> bool:
+        if claims.get("jti") in self._tokens:
+            return True
+        user = self._users.get(claims.get("uuid"))
+        return user is not None and claims.get("iat", 0) <= user[0]
+
+    async def revoke_token(self, jti: str, expires_at: datetime):
+        self._tokens[jti] = _epoch(expires_at)
+        await collections["revoked_tokens"].insert_one({
+            "kind": "token",
+            "value": jti,
+            "revoked_at": datetime.utcnow(),
+            "expires_at": expires_at,
+        })
+
+    async def revoke_user(self, user_uuid: str, lifetime: timedelta):
+        """
+        Revoke every token issued to the user so far. `lifetime` is the
+        longest a token issued now could still be valid.
+        """
+        before = time.time()
+        expires_at = datetime.utcnow() + lifetime
+        self._users[user_uuid] = (before, _epoch(expires_at))
+        await collections["revoked_tokens"].insert_one({
+            "kind": "user",
+            "value": user_uuid,
+            "before": before,
+            "revoked_at": datetime.utcnow(),
+            "expires_at": expires_at,
+        })
+
+    async def sync(self):
+        now = datetime.utcnow()
+        query = {"expires_at": {"$gt": now}}
+        if self._last_sync is not None:
+            query["revoked_at"] = {"$gte": self._last_sync - SYNC_OVERLAP}
+        async for doc in collections["revoked_tokens"].find(query):
+            expires = _epoch(doc["expires_at"])
+            if doc["kind"] == "token":
+                self._tokens[doc["value"]] = expires
+            else:
+                current = self._users.get(doc["value"])
+                if current is None or current[0] < doc["before"]:
+                    self._users[doc["value"]] = (doc["before"], expires)
+        self._last_sync = now
+        self._prune(time.time())
+
+    def _prune(self, now: float):
+        self._tokens = {jti: expires for jti, expires in self._tokens.items() if expires > now}
+        self._users = {user: entry for user, entry in self._users.items() if entry[1] > now}
+
+    async def start(self):
+        await collections["revoked_tokens"].create_index("expires_at", expireAfterSeconds=0)
+        await collections["revoked_tokens"].create_index("revoked_at")
+        await self.sync()
+        self._syncer.start()
+
+    async def stop(self):
+        await self._syncer.stop()
+
+
+revocations = RevocationList()
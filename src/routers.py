@@ -0,0 +1,233 @@
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+
+from .auth import get_current_user
+from .registry import registry
+from .schema import APIResponse, Person
+from .softdelete import live
+from . import audit, softdelete, versions
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_SIZE = 1000
+
+
+async def pagination(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    # async so FastAPI calls it inline instead of hopping to the threadpool.
+    return skip, limit
+
+
+def jsonable(value):
+    """
+    JSON-ready copy of a Mongo document. Documents read back from our own
+    collections were validated on the way in, so reads skip re-building
+    them as models.
+    """
+    if isinstance(value, dict):
+        return {k: jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [jsonable(v) for v in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _projection(model, fields: Optional[str]) -> Dict[str, int]:
+    aliases = {f.name: f.alias for f in model.__fields__.values()}
+    if not fields:
+        return {alias: 1 for alias in aliases.values()}
+    wanted = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in wanted if name not in aliases and name not in aliases.values()]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {aliases.get(name, name): 1 for name in wanted}
+    projection["uuid"] = 1
+    return projection
+
+
+def _respond(code: int, message: str, data=None, headers=None):
+    return JSONResponse({"code": code, "message": message, "data": data}, headers=headers)
+
+
+def build_entity_router(name: str, access: Dict[str, list], on_write: Optional[Callable] = None) -> APIRouter:
+    """
+    list/get/create/update/delete and bulk routes for a registry entity.
+
+    Only operations with at least one allowed role in `access` are
+    generated. Reads are paginated and projected, and every mutation is a
+    single round trip. `on_write(written, removed)`, when given, is called
+    after each successful mutation with the stored documents and the
+    deleted uuids, for in-memory indexes over the entity.
+    """
+    model = registry[name]["model"]
+    collection = registry[name]["collection"]
+    label = name.capitalize()
+    # Reference fields (patient_id, medicine_id, ...) can be used as list filters.
+    filterable = {f for f in model.__fields__ if f.endswith("_id")}
+    # Field audit events find the patient through; reads always fetch it.
+    patient_field = next((f for f in ("patient_id", "medical_history_id") if f in model.__fields__), None)
+    router = APIRouter(prefix=f"/{name}", tags=[name])
+
+    def authorize(current_user: Optional[Person], operation: str, detail: str):
+        if current_user is None:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        if current_user.role not in access.get(operation, []):
+            raise HTTPException(status_code=403, detail=detail)
+
+    async def record(current_user, action, entity_id=None, docs=()):
+        if patient_field is None:
+            return
+        for patient_id in await audit.patients_of(patient_field, docs) or [None]:
+            audit.record(current_user, action, name, entity_id, patient_id)
+
+    def project(fields: Optional[str]):
+        """
+        Projection for a read, and the patient field if it was added only
+        for the audit event (so it is left out of the response).
+        """
+        projection = _projection(model, fields)
+        extra = patient_field if patient_field and patient_field not in projection else None
+        if extra:
+            projection[extra] = 1
+        return projection, extra
+
+    def shown(doc: dict, extra: Optional[str]) -> dict:
+        return jsonable({k: v for k, v in doc.items() if k != extra} if extra else doc)
+
+    if access.get("read"):
+        @router.get("", response_model=APIResponse[List[model]])
+        async def list_items(
+            request: Request,
+            response: Response,
+            page: tuple = Depends(pagination),
+            fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "read", "Not authorized")
+            headers = versions.check_not_modified(request, response, name)
+            query = live({k: v for k, v in request.query_params.items() if k in filterable})
+            skip, limit = page
+            projection, extra = project(fields)
+            cursor = collection.find(query, projection).sort("_id", 1).skip(skip).limit(limit)
+            docs = [doc async for doc in cursor]
+            await record(current_user, "list", docs=docs)
+            items = [shown(doc, extra) for doc in docs]
+            return _respond(200, f"{label}s retrieved successfully", items, headers)
+
+        @router.get("/{uuid}", response_model=APIResponse[model])
+        async def get_item(
+            uuid: str,
+            fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "read", "Not authorized")
+            projection, extra = project(fields)
+            doc = await collection.find_one(live({"uuid": uuid}), projection)
+            if not doc:
+                raise HTTPException(status_code=404, detail=f"{label} not found")
+            await record(current_user, "read", uuid, [doc])
+            return _respond(200, f"{label} retrieved successfully", shown(doc, extra))
+
+    if access.get("create"):
+        @router.post("/bulk", response_model=APIResponse[List[str]])
+        async def create_items(
+            items: List[model] = Body(...),
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "create", f"Not authorized to create {name}")
+            if len(items) > MAX_BULK_SIZE:
+                raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_SIZE} items per request")
+            docs = [item.dict(by_alias=True) for item in items]
+            if docs:
+                await collection.insert_many(docs, ordered=False)
+                versions.bump(name)
+                if on_write:
+                    on_write(docs, ())
+                await record(current_user, "bulk_create", docs=docs)
+            return _respond(201, f"{len(docs)} {name} created successfully", [doc["uuid"] for doc in docs])
+
+        @router.post("", response_model=APIResponse[model])
+        async def create_item(
+            data: model,
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "create", f"Not authorized to create {name}")
+            doc = data.dict(by_alias=True)
+            await collection.insert_one(doc)
+            versions.bump(name)
+            if on_write:
+                on_write([doc], ())
+            await record(current_user, "create", doc["uuid"], [doc])
+            return _respond(201, f"{label} created successfully", jsonable(doc))
+
+    if access.get("update"):
+        @router.put("/{uuid}", response_model=APIResponse[model])
+        async def update_item(
+            uuid: str,
+            data: model = Body(...),
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "update", f"Not authorized to update {name}")
+            changes = data.dict(by_alias=True, exclude_unset=True)
+            changes.pop("_id", None)
+            changes.pop("uuid", None)
+            projection = _projection(model, None)
+            if changes:
+                doc = await collection.find_one_and_update(
+                    live({"uuid": uuid}), {"$set": changes},
+                    projection=projection, return_document=ReturnDocument.AFTER,
+                )
+            else:
+                doc = await collection.find_one(live({"uuid": uuid}), projection)
+            if not doc:
+                raise HTTPException(status_code=404, detail=f"{label} not found")
+            versions.bump(name)
+            if on_write:
+                on_write([doc], ())
+            await record(current_user, "update", uuid, [doc])
+            return _respond(200, f"{label} updated successfully", jsonable(doc))
+
+    if access.get("delete"):
+        @router.delete("/bulk", response_model=APIResponse[int])
+        async def delete_items(
+            uuids: List[str] = Body(...),
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "delete", f"Not authorized to delete {name}")
+            if len(uuids) > MAX_BULK_SIZE:
+                raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_SIZE} items per request")
+            deleted = await softdelete.delete_many(name, {"uuid": {"$in": uuids}})
+            if deleted:
+                versions.bump(name)
+                if on_write:
+                    on_write((), uuids)
+                await record(current_user, "bulk_delete")
+            return _respond(200, f"{deleted} {name} deleted successfully", deleted)
+
+        @router.delete("/{uuid}", response_model=APIResponse[None])
+        async def delete_item(
+            uuid: str,
+            current_user: Optional[Person] = Depends(get_current_user),
+        ):
+            authorize(current_user, "delete", f"Not authorized to delete {name}")
+            projection = {"_id": 1, patient_field: 1} if patient_field else {"_id": 1}
+            doc = await softdelete.delete_one(name, {"uuid": uuid}, projection=projection)
+            if not doc:
+                raise HTTPException(status_code=404, detail=f"{label} not found")
+            versions.bump(name)
+            if on_write:
+                on_write((), [uuid])
+            await record(current_user, "delete", uuid, [doc])
+            return _respond(200, f"{label} deleted successfully")
+
+    return router
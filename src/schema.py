@@ -189,57 +189,36 @@ class GetModel(Generic[T], MongoBaseModel):
 class DeleteModel(MongoBaseModel):
     id: PyObjectId
 
-PersonCreate = CreateModel[Person]
-PersonUpdate = UpdateModel[Person]
-PersonGet = GetModel[Person]
-PersonDelete = DeleteModel
-
-MedicineCreate = CreateModel[Medicine]
-MedicineUpdate = UpdateModel[Medicine]
-MedicineGet = GetModel[Medicine]
-MedicineDelete = DeleteModel
-
-MedicationCreate = CreateModel[Medication]
-MedicationUpdate = UpdateModel[Medication]
-MedicationGet = GetModel[Medication]
-MedicationDelete = DeleteModel
-
-AllergyCreate = CreateModel[Allergy]
-AllergyUpdate = UpdateModel[Allergy]
-AllergyGet = GetModel[Allergy]
-AllergyDelete = DeleteModel
-
-AllergyDiagnosisCreate = CreateModel[AllergyDiagnosis]
-AllergyDiagnosisUpdate = UpdateModel[AllergyDiagnosis]
-AllergyDiagnosisGet = GetModel[AllergyDiagnosis]
-AllergyDiagnosisDelete = DeleteModel
-
-ConditionCreate = CreateModel[Condition]
-ConditionUpdate = UpdateModel[Condition]
-ConditionGet = GetModel[Condition]
-ConditionDelete = DeleteModel
-
-ConditionDiagnosisCreate = CreateModel[ConditionDiagnosis]
-ConditionDiagnosisUpdate = UpdateModel[ConditionDiagnosis]
-ConditionDiagnosisGet = GetModel[ConditionDiagnosis]
-ConditionDiagnosisDelete = DeleteModel
-
-SurgeryCreate = CreateModel[Surgery]
-SurgeryUpdate = UpdateModel[Surgery]
-SurgeryGet = GetModel[Surgery]
-SurgeryDelete = DeleteModel
-
-PastSurgeryCreate = CreateModel[PastSurgery]
-PastSurgeryUpdate = UpdateModel[PastSurgery]
-PastSurgeryGet = GetModel[PastSurgery]
-PastSurgeryDelete = DeleteModel
-
-MedicalHistoryCreate = CreateModel[MedicalHistory]
-MedicalHistoryUpdate = UpdateModel[MedicalHistory]
-MedicalHistoryGet = GetModel[MedicalHistory]
-MedicalHistoryDelete = DeleteModel
-
-InsuranceCreate = CreateModel[Insurance]
-InsuranceUpdate = UpdateModel[Insurance]
-InsuranceGet = GetModel[Insurance]
-InsuranceDelete = DeleteModel
\ No newline at end of file
+# Response models used by the handlers, specialised once at import rather
+# than per request.
+PersonResponse = APIResponse[Person]
+PersonListResponse = APIResponse[List[Person]]
+MedicineListResponse = APIResponse[List[Medicine]]
+MedicationResponse = APIResponse[Medication]
+PastSurgeryResponse = APIResponse[PastSurgery]
+ConditionDiagnosisResponse = APIResponse[ConditionDiagnosis]
+AllergyDiagnosisResponse = APIResponse[AllergyDiagnosis]
+DictResponse = APIResponse[dict]
+DictListResponse = APIResponse[List[dict]]
+EmptyResponse = APIResponse[None]
+
+_ALIASED_MODELS = {
+    model.__name__: model
+    for model in (Person, Medicine, Medication, Allergy, AllergyDiagnosis, Condition,
+                  ConditionDiagnosis, Surgery, PastSurgery, MedicalHistory, Insurance)
+}
+_ALIAS_GENERICS = {"Create": CreateModel, "Update": UpdateModel, "Get": GetModel}
+
+
+def __getattr__(name):
+    """
+    PersonCreate, MedicineUpdate, InsuranceGet, ... are built on first
+    access instead of at import, and are not picked up by `import *`.
+    """
+    for suffix in ("Create", "Update", "Get", "Delete"):
+        model = _ALIASED_MODELS.get(name[:-len(suffix)]) if name.endswith(suffix) else None
+        if model is not None:
+            value = DeleteModel if suffix == "Delete" else _ALIAS_GENERICS[suffix][model]
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
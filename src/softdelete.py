@@ -0,0 +1,253 @@
+"""
+Soft delete: with SOFT_DELETE=1 (the default) deletes only stamp
+`deleted_at`, read paths filter on it via `live()`, and a background
+compactor purges tombstones older than SOFT_DELETE_RETENTION_DAYS during
+the off-peak hours in SOFT_DELETE_COMPACT_HOURS, at most
+SOFT_DELETE_COMPACT_RATE documents per second. Every worker runs a
+compactor, but only the holder of the compaction lease purges, so the
+rate holds across workers.
+
+Purge now, ignoring the window:
+
+    python -m src.softdelete compact
+    python -m src.softdelete compact --days 0
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .database import collections
+from .periodic import Periodic
+from . import archive, caseload
+
+SOFT_DELETE = os.getenv("SOFT_DELETE", "1") == "1"
+SOFT_DELETE_RETENTION_DAYS = int(os.getenv("SOFT_DELETE_RETENTION_DAYS", 30))
+# UTC hours, start inclusive and end exclusive; "22-4" wraps past midnight.
+SOFT_DELETE_COMPACT_HOURS = os.getenv("SOFT_DELETE_COMPACT_HOURS", "1-5")
+SOFT_DELETE_COMPACT_BATCH_SIZE = int(os.getenv("SOFT_DELETE_COMPACT_BATCH_SIZE", 500))
+SOFT_DELETE_COMPACT_RATE = float(os.getenv("SOFT_DELETE_COMPACT_RATE", 1000))
+COMPACT_CHECK_SECONDS = 600
+COMPACT_LEASE_ID = "softdelete-compactor"
+COMPACT_LEASE_SECONDS = 60
+
+SOFT_DELETED = [
+    "persons", "medical_history", "medication", "past_surgery", "condition_diagnosis",
+    "allergy_diagnosis", "medicine", "allergy", "condition", "surgery", "insurance",
+]
+# Clinical collections hanging off a medical history, deleted with it.
+CHART_COLLECTIONS = ["medication", "past_surgery", "condition_diagnosis", "allergy_diagnosis"]
+
+logger = logging.getLogger(__name__)
+
+
+def live(query: Optional[dict] = None) -> dict:
+    """
+    `query` restricted to documents that are not soft-deleted.
+    """
+    query = dict(query or {})
+    if SOFT_DELETE:
+        query["deleted_at"] = None
+    return query
+
+
+async def ensure_indexes():
+    # Mongo partial filters cannot express "field missing", so the partial
+    # index holds the tombstones only: it serves the compactor and
+    # restores, while live reads keep using the existing indexes with
+    # `deleted_at: None` as a residual filter.
+    for name in SOFT_DELETED:
+        await collections[name].create_index(
+            "deleted_at", partialFilterExpression={"deleted_at": {"$exists": True}}
+        )
+
+
+async def delete_one(name: str, query: dict, deleted_at: Optional[datetime] = None,
+                     projection: Optional[dict] = None) -> Optional[dict]:
+    """
+    Delete the first match in one round trip and return it as it was, or
+    None if nothing matched.
+    """
+    if SOFT_DELETE:
+        return await collections[name].find_one_and_update(
+            live(query), {"$set": {"deleted_at": deleted_at or datetime.utcnow()}},
+            projection=projection, return_document=ReturnDocument.BEFORE,
+        )
+    return await collections[name].find_one_and_delete(query, projection=projection)
+
+
+async def delete_many(name: str, query: dict, deleted_at: Optional[datetime] = None) -> int:
+    if SOFT_DELETE:
+        result = await collections[name].update_many(
+            live(query), {"$set": {"deleted_at": deleted_at or datetime.utcnow()}}
+        )
+        return result.modified_count
+    result = await collections[name].delete_many(query)
+    return result.deleted_count
+
+
+async def restore_one(name: str, query: dict) -> Optional[dict]:
+    """
+    Clear the tombstone of the first soft-deleted match and return it as it
+    was (so callers can see its `deleted_at`), or None. `query` may pin
+    `deleted_at` to restore one cascade only.
+    """
+    return await collections[name].find_one_and_update(
+        {"deleted_at": {"$ne": None}, **query}, {"$unset": {"deleted_at": ""}},
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+async def restore_many(name: str, query: dict) -> int:
+    result = await collections[name].update_many(
+        {"deleted_at": {"$ne": None}, **query}, {"$unset": {"deleted_at": ""}}
+    )
+    return result.modified_count
+
+
+async def after_purge(name: str, docs: List[dict]):
+    """
+    Drop derived data of documents that are gone for good. Runs right after
+    a hard delete, or from the compactor once tombstones are purged.
+    """
+    if name == "persons":
+        for doc in docs:
+            if doc.get("role") == "patient":
+                await caseload.forget_patient(doc["uuid"])
+            elif doc.get("role") == "doctor":
+                await caseload.forget_doctor(doc["uuid"])
+    elif name == "medical_history":
+        for doc in docs:
+            await archive.forget(doc["uuid"])
+
+
+def compact_window(spec: str = SOFT_DELETE_COMPACT_HOURS) -> tuple:
+    start, end = (int(hour) % 24 for hour in spec.split("-"))
+    return start, end
+
+
+def in_window(now: Optional[datetime] = None, spec: str = SOFT_DELETE_COMPACT_HOURS) -> bool:
+    start, end = compact_window(spec)
+    hour = (now or datetime.utcnow()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+async def compact(
+    days: int = SOFT_DELETE_RETENTION_DAYS,
+    batch_size: int = SOFT_DELETE_COMPACT_BATCH_SIZE,
+    rate: float = SOFT_DELETE_COMPACT_RATE,
+    keep_going: Callable[[], bool] = lambda: True,
+) -> Dict[str, int]:
+    """
+    Purge tombstones older than `days`, `batch_size` at a time, sleeping
+    between batches so no more than `rate` documents per second are
+    removed. Stops early once `keep_going()` turns false.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    purged = {}
+    for name in SOFT_DELETED:
+        collection = collections[name]
+        purged[name] = 0
+        while keep_going():
+            expired = {"deleted_at": {"$lt": cutoff}}
+            docs = [doc async for doc in collection.find(expired, {"uuid": 1, "role": 1}).limit(batch_size)]
+            if not docs:
+                break
+            await collection.delete_many({**expired, "_id": {"$in": [doc["_id"] for doc in docs]}})
+            await after_purge(name, docs)
+            purged[name] += len(docs)
+            await asyncio.sleep(len(docs) / rate)
+    return purged
+
+
+class Compactor:
+    def __init__(self):
+        self._checker = Periodic("Soft delete compaction", COMPACT_CHECK_SECONDS, self._compact_in_window)
+        self._holder = uuid.uuid4().hex
+        self._held = False
+
+    async def acquire(self) -> bool:
+        """
+        Take or renew the compaction lease. The upsert only inserts when no
+        lease document matched; if another holder's unexpired lease exists,
+        that insert hits its _id and the lease is not ours.
+        """
+        now = datetime.utcnow()
+        try:
+            await collections["leases"].update_one(
+                {"_id": COMPACT_LEASE_ID, "$or": [{"holder": self._holder}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"holder": self._holder, "expires_at": now + timedelta(seconds=COMPACT_LEASE_SECONDS)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            self._held = False
+        else:
+            self._held = True
+        return self._held
+
+    async def release(self):
+        self._held = False
+        await collections["leases"].delete_one({"_id": COMPACT_LEASE_ID, "holder": self._holder})
+
+    async def _renew(self):
+        if not self._held:
+            return
+        try:
+            await self.acquire()
+        except Exception:
+            self._held = False
+            raise
+
+    async def run_once(self, keep_going: Callable[[], bool] = lambda: True, **kwargs) -> Optional[Dict[str, int]]:
+        """
+        compact() under the lease; None if another process holds it. Stops
+        early if the lease is lost.
+        """
+        if not await self.acquire():
+            return None
+        renewing = Periodic("Renewing the compaction lease", COMPACT_LEASE_SECONDS / 3, self._renew)
+        renewing.start()
+        try:
+            return await compact(keep_going=lambda: self._held and keep_going(), **kwargs)
+        finally:
+            await renewing.stop()
+            await self.release()
+
+    async def start(self):
+        if SOFT_DELETE:
+            self._checker.start(immediately=True)
+
+    async def stop(self):
+        await self._checker.stop()
+
+    async def _compact_in_window(self):
+        if in_window():
+            purged = await self.run_once(keep_going=in_window)
+            if purged and any(purged.values()):
+                logger.info("Purged soft-deleted documents: %s", purged)
+
+
+compactor = Compactor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge soft-deleted documents.")
+    parser.add_argument("command", choices=["compact"])
+    parser.add_argument("--days", type=int, default=SOFT_DELETE_RETENTION_DAYS)
+    parser.add_argument("--batch-size", type=int, default=SOFT_DELETE_COMPACT_BATCH_SIZE)
+    parser.add_argument("--rate", type=float, default=SOFT_DELETE_COMPACT_RATE)
+    args = parser.parse_args()
+    purged = asyncio.run(compactor.run_once(days=args.days, batch_size=args.batch_size, rate=args.rate))
+    if purged is None:
+        sys.exit("Another compactor holds the lease; try again later.")
+    for name, count in purged.items():
+        print(f"{name}: {count} documents purged")
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request, Response
+
+from .database import collections
+from .periodic import Periodic
+
+# Counters are shared through the `versions` collection so that writes
+# made by other workers and by the CLIs invalidate this worker's tags.
+# bump() counts locally and the increments are pushed right away; other
+# workers' increments are pulled every VERSIONS_SYNC_SECONDS, which bounds
+# how long a stale 304 can be served. The epoch lives in the same
+# collection, so tags only stop matching if the counters are reset.
+VERSIONS_SYNC_SECONDS = float(os.getenv("VERSIONS_SYNC_SECONDS", 1))
+EPOCH_ID = "_epoch"
+
+logger = logging.getLogger(__name__)
+
+_epoch = uuid.uuid4().hex[:8]
+_started = time.time()
+_versions: Dict[str, int] = {}
+_modified: Dict[str, float] = {}
+# Bumps made here and not yet added to the shared counters.
+_pending: Dict[str, int] = {}
+_flushing: Optional[asyncio.Task] = None
+
+# Suffixes the compression middleware appends to a strong ETag.
+ENCODING_SUFFIXES = ("-gzip", "-br", "-zstd")
+
+
+def bump(*names: str):
+    """
+    Record a write to the given collections.
+    """
+    now = time.time()
+    for name in names:
+        _versions[name] = _versions.get(name, 0) + 1
+        _pending[name] = _pending.get(name, 0) + 1
+        _modified[name] = now
+    global _flushing
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _flushing is None or _flushing.done():
+        _flushing = loop.create_task(_flush_logged())
+
+
+def version(name: str) -> int:
+    return _versions.get(name, 0)
+
+
+async def flush():
+    """
+    Add the local bumps to the shared counters. CLIs that write must await
+    this before exiting.
+    """
+    while _pending:
+        name, count = _pending.popitem()
+        try:
+            await collections["versions"].update_one(
+                {"_id": name},
+                {"$inc": {"version": count}, "$max": {"modified": datetime.utcnow()}},
+                upsert=True,
+            )
+        except Exception:
+            _pending[name] = _pending.get(name, 0) + count
+            raise
+
+
+async def _flush_logged():
+    try:
+        await flush()
+    except Exception:
+        logger.exception("Version flush failed; retrying on the next sync")
+
+
+async def sync():
+    """
+    Push local bumps, then pull every counter. Bumps made while the pull is
+    in flight are still pending and are added back on top.
+    """
+    global _epoch
+    await flush()
+    async for doc in collections["versions"].find({}):
+        if doc["_id"] == EPOCH_ID:
+            _epoch = doc["epoch"]
+            continue
+        shared = doc.get("version", 0) + _pending.get(doc["_id"], 0)
+        if shared > _versions.get(doc["_id"], 0):
+            _versions[doc["_id"]] = shared
+            modified = doc.get("modified")
+            if modified is not None:
+                _modified[doc["_id"]] = max(
+                    _modified.get(doc["_id"], 0.0), modified.replace(tzinfo=timezone.utc).timestamp()
+                )
+
+
+_syncer = Periodic("Version sync", VERSIONS_SYNC_SECONDS, sync)
+
+
+async def start():
+    try:
+        await collections["versions"].update_one(
+            {"_id": EPOCH_ID}, {"$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}}, upsert=True
+        )
+        await sync()
+    except Exception:
+        logger.exception("Version sync failed; tags are local to this worker until it recovers")
+    _syncer.start()
+
+
+async def stop():
+    await _syncer.stop()
+    await _flush_logged()
+
+
+def _etag(request: Request, names, variant: str) -> str:
+    digest = hashlib.sha1()
+    digest.update(request.url.path.encode())
+    digest.update(b"?")
+    digest.update(request.url.query.encode())
+    digest.update(b"|")
+    digest.update(variant.encode())
+    for name in names:
+        digest.update(f"|{name}:{_versions.get(name, 0)}".encode())
+    return f'"{_epoch}-{digest.hexdigest()[:20]}"'
+
+
+def _last_modified(names):
+    """
+    Returns (last_modified, settled). HTTP dates have one-second
+    resolution, so until the second of the last write has passed the date
+    is not settled and must not be used to answer 304; afterwards the end
+    of that second is reported, so a copy generated earlier in it can never
+    validate as current.
+    """
+    stamp = max([_modified.get(name, _started) for name in names] or [_started])
+    seconds = int(stamp)
+    settled = time.time() >= seconds + 1
+    if settled:
+        seconds += 1
+    return datetime.fromtimestamp(seconds, tz=timezone.utc), settled
+
+
+def _strip_encoding(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix + '"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def check_not_modified(request: Request, response: Response, *names: str, variant: str = ""):
+    """
+    Set ETag/Last-Modified for a response built from the given collections,
+    and raise 304 if the client's copy is still current.
+
+    Call this after the authorization checks of the handler, since it
+    short-circuits the rest of it. Returns the validator headers for
+    handlers that build their own Response.
+    """
+    etag = _etag(request, names, variant)
+    last_modified, settled = _last_modified(names)
+    headers = {"ETag": etag, "Last-Modified": format_datetime(last_modified, usegmt=True)}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [_strip_encoding(tag) for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            raise HTTPException(status_code=304, headers=headers)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and settled:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and since.tzinfo is not None and last_modified <= since:
+                raise HTTPException(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return headers
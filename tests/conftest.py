@@ -0,0 +1,84 @@
+"""
+The suite runs on the in-memory database backend; nothing needs mongod.
+The settings below have to be in place before src is imported.
+"""
+import asyncio
+import os
+import uuid
+
+os.environ["DATABASE_BACKEND"] = "memory"
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("AUDIT_SPILL_PATH", os.path.join(os.path.dirname(__file__), ".audit_spill.ndjson"))
+# One test client plays every user; admission control has its own tests.
+os.environ.setdefault("RATE_LIMITS", ",".join(
+    f"{role}=1e9:1e9" for role in ("anonymous", "patient", "receptionist", "doctor", "admin")
+))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.app import app
+from src.auth import hash_password
+from src.database import collections
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def unique(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def login(client, username: str, password: str) -> dict:
+    response = client.post("/login", data={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def auth(tokens: dict) -> dict:
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
+
+
+@pytest.fixture(scope="session")
+def admin(client):
+    username = unique("admin")
+    run(collections["persons"].insert_one({
+        "uuid": username, "username": username, "password": hash_password("admin"), "role": "admin",
+    }))
+    return auth(login(client, username, "admin"))
+
+
+def create_user(client, admin, role: str) -> dict:
+    username = unique(role)
+    response = client.post("/signup", headers=admin,
+                           json={"username": username, "password": "pw", "role": role, "name": username})
+    assert response.status_code == 200, response.text
+    return {"uuid": response.json()["uuid"], "username": username, "headers": auth(login(client, username, "pw"))}
+
+
+@pytest.fixture
+def doctor(client, admin):
+    return create_user(client, admin, "doctor")
+
+
+@pytest.fixture
+def receptionist(client, admin):
+    return create_user(client, admin, "receptionist")
+
+
+@pytest.fixture
+def patient(client):
+    username = unique("patient")
+    response = client.post("/signup", json={
+        "username": username, "password": "pw", "role": "patient", "name": f"Test {username}",
+        "contact_details": {"phone_num": "+923001234567"},
+    })
+    assert response.status_code == 200, response.text
+    return {"uuid": response.json()["uuid"], "username": username}
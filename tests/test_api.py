@@ -0,0 +1,167 @@
+import json
+from datetime import datetime, timedelta
+
+from jose import jwt
+
+from src import audit
+from src.database import collections
+
+from .conftest import login, run, unique
+
+
+def new_medicine(client, doctor, **fields):
+    response = client.post("/medicine", headers=doctor["headers"], json={"name": unique("med"), **fields})
+    assert response.status_code == 200, response.text
+    return response.json()["data"]
+
+
+def prescribe(client, doctor, patient, medicine):
+    return client.post(f"/doctor/prescribe-medicine/{patient['uuid']}", headers=doctor["headers"],
+                       json={"medicine_id": medicine["uuid"], "dosage": "1x daily"})
+
+
+def test_signup_replays_idempotency_key(client):
+    body = {"username": unique("patient"), "password": "pw", "role": "patient", "name": "Idem Potent"}
+    headers = {"Idempotency-Key": unique("key")}
+    first = client.post("/signup", json=body, headers=headers)
+    second = client.post("/signup", json=body, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json()["uuid"] == second.json()["uuid"]
+    # Without the key the retry is a new request, and the username is taken.
+    assert client.post("/signup", json=body).status_code == 400
+
+
+def test_forged_token_does_not_replay_another_users_response(client, doctor, patient):
+    medicine = new_medicine(client, doctor)
+    body = {"medicine_id": medicine["uuid"], "dosage": "1x daily"}
+    url = f"/doctor/prescribe-medicine/{patient['uuid']}"
+    key = {"Idempotency-Key": unique("key")}
+    assert client.post(url, json=body, headers={**doctor["headers"], **key}).status_code == 200
+
+    forged = jwt.encode({"uuid": doctor["uuid"], "sub": doctor["username"]}, "not-the-secret", algorithm="HS256")
+    replayed = client.post(url, json=body, headers={"Authorization": f"Bearer {forged}", **key})
+    assert replayed.status_code == 401
+
+
+def test_refresh_rotates_and_logout_revokes(client, patient):
+    tokens = login(client, patient["username"], "pw")
+    rotated = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert rotated.status_code == 200
+    assert client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+
+    headers = {"Authorization": f"Bearer {rotated.json()['access_token']}"}
+    assert client.get(f"/patients/{patient['uuid']}", headers=headers).status_code == 200
+    assert client.post("/logout", headers=headers).status_code == 200
+    assert client.get(f"/patients/{patient['uuid']}", headers=headers).status_code == 401
+    assert client.post("/token/refresh", json={"refresh_token": rotated.json()["refresh_token"]}).status_code == 401
+
+
+def test_chart_etag(client, doctor, patient):
+    url = f"/patients/{patient['uuid']}"
+    first = client.get(url, headers=doctor["headers"])
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert client.get(url, headers={**doctor["headers"], "If-None-Match": etag}).status_code == 304
+
+    prescribe(client, doctor, patient, new_medicine(client, doctor))
+    changed = client.get(url, headers={**doctor["headers"], "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.json()["data"]["medical_history"]["medications"]) == 1
+
+
+def test_expired_medicine_is_not_prescribed(client, doctor, patient):
+    now = datetime.utcnow()
+    expired = new_medicine(client, doctor, expiry_date=(now - timedelta(days=1)).isoformat())
+    soon = new_medicine(client, doctor, expiry_date=(now + timedelta(days=3)).isoformat())
+    assert prescribe(client, doctor, patient, expired).status_code == 400
+    assert prescribe(client, doctor, patient, soon).status_code == 200
+
+    expiring = client.get("/medicine/expiring", headers=doctor["headers"], params={"within": 7})
+    uuids = [m["uuid"] for m in expiring.json()["data"]]
+    assert soon["uuid"] in uuids and expired["uuid"] not in uuids
+    expiring = client.get("/medicine/expiring", headers=doctor["headers"],
+                          params={"within": 7, "include_expired": True})
+    assert expired["uuid"] in [m["uuid"] for m in expiring.json()["data"]]
+
+
+def test_caseload_follows_clinical_records(client, admin, doctor, patient):
+    prescribed = prescribe(client, doctor, patient, new_medicine(client, doctor)).json()["data"]
+    caseload = client.get(f"/doctors/{doctor['uuid']}/patients", headers=doctor["headers"]).json()["data"]
+    assert [(e["patient"]["uuid"], e["record_count"]) for e in caseload] == [(patient["uuid"], 1)]
+
+    url = f"/doctor/prescribe-medicine/{prescribed['uuid']}"
+    assert client.delete(url, headers=doctor["headers"]).status_code == 200
+    assert client.get(f"/doctors/{doctor['uuid']}/patients", headers=doctor["headers"]).json()["data"] == []
+
+    restored = client.post(f"/admin/restore/medication/{prescribed['uuid']}", headers=admin)
+    assert restored.status_code == 200
+    caseload = client.get(f"/doctors/{doctor['uuid']}/patients", headers=admin).json()["data"]
+    assert [e["patient"]["uuid"] for e in caseload] == [patient["uuid"]]
+
+
+def test_deleted_patient_is_restored_with_chart(client, admin, doctor, patient):
+    prescribe(client, doctor, patient, new_medicine(client, doctor))
+    assert client.delete(f"/persons/{patient['uuid']}", headers=admin).status_code == 200
+    assert client.get(f"/patients/{patient['uuid']}", headers=doctor["headers"]).status_code == 404
+
+    restored = client.post(f"/admin/restore/persons/{patient['uuid']}", headers=admin).json()["data"]
+    assert restored["medical_history"] == 1 and restored["medication"] == 1
+    chart = client.get(f"/patients/{patient['uuid']}", headers=doctor["headers"]).json()["data"]
+    assert len(chart["medical_history"]["medications"]) == 1
+
+
+def test_receptionist_finds_patients(client, receptionist, patient):
+    headers = receptionist["headers"]
+    found = client.get("/receive-patient", headers=headers, params={"username": patient["username"]})
+    assert found.status_code == 200 and found.json()["data"]["uuid"] == patient["uuid"]
+    search = client.get("/receive-patient/search", headers=headers, params={"q": patient["username"]})
+    assert [p["uuid"] for p in search.json()["data"]] == [patient["uuid"]]
+
+
+def test_ndjson_import_reports_rejected_rows(client, receptionist):
+    username = unique("imported")
+    rows = [
+        {"username": username, "password": "pw", "role": "patient", "name": "Imported One"},
+        {"username": username, "password": "pw", "role": "patient", "name": "Imported Twice"},
+        {"username": unique("imported"), "password": "pw", "role": "patient", "name": "Imported Two"},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = client.post("/import/patients", params={"format": "ndjson"}, content=body,
+                           headers=receptionist["headers"])
+    assert response.status_code == 200, response.text
+    report = response.json()["data"]
+    assert (report["rows"], report["inserted"], report["rejected"]) == (3, 2, 1)
+    login(client, username, "pw")
+
+
+def test_catalog_import_rejects_duplicate_ids(client, admin, doctor):
+    exported = run(collections["medicine"].find_one({"uuid": new_medicine(client, doctor)["uuid"]}))
+    rows = [
+        {"_id": str(exported["_id"]), "name": "Reimported"},
+        {"name": unique("med"), "expiry_date": (datetime.utcnow() + timedelta(days=2)).isoformat()},
+    ]
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = client.post("/import/medicine", params={"format": "ndjson"}, content=body, headers=admin)
+    assert response.status_code == 200, response.text
+    report = response.json()["data"]
+    assert (report["rows"], report["inserted"], report["rejected"]) == (2, 1, 1)
+    assert report["errors"][0]["row"] == 1
+
+    expiring = client.get("/medicine/expiring", headers=doctor["headers"], params={"within": 7}).json()["data"]
+    assert rows[1]["name"] in [m["name"] for m in expiring]
+
+
+def test_clinical_reads_are_audited_with_their_patient(client, monkeypatch, doctor, patient):
+    events = []
+    monkeypatch.setattr(audit.audit_log, "record", lambda *event: events.append(event))
+    prescribed = prescribe(client, doctor, patient, new_medicine(client, doctor)).json()["data"]
+
+    read = client.get(f"/medication/{prescribed['uuid']}", headers=doctor["headers"], params={"fields": "dosage"})
+    assert read.status_code == 200
+    assert "medical_history_id" not in read.json()["data"]
+    listed = client.get("/medication", headers=doctor["headers"],
+                        params={"medical_history_id": prescribed["medical_history_id"]})
+    assert listed.status_code == 200
+
+    reads = [(action, patient_id) for _, action, entity, _, patient_id in events if entity == "medication"]
+    assert ("read", patient["uuid"]) in reads and ("list", patient["uuid"]) in reads
@@ -0,0 +1,222 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from src import memory_db
+from src.memory_db import MemoryClient
+
+from .conftest import run
+
+
+@pytest.fixture
+def coll():
+    return MemoryClient()["test"]["items"]
+
+
+def find(coll, query=None, projection=None, sort=None):
+    async def go():
+        cursor = coll.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return [doc async for doc in cursor]
+    return run(go())
+
+
+def names(docs):
+    return [doc["name"] for doc in docs]
+
+
+@pytest.fixture
+def people(coll):
+    run(coll.insert_many([
+        {"name": "a", "age": 30, "tags": ["x", "y"], "address": {"city": "Karachi"}},
+        {"name": "b", "age": 40, "tags": ["y"], "address": {"city": "Lahore"}, "deleted_at": None},
+        {"name": "c", "age": None, "deleted_at": datetime(2024, 1, 1)},
+        {"name": "d"},
+    ]))
+    return coll
+
+
+def test_equality_null_matches_missing(people):
+    assert names(find(people, {"deleted_at": None}, sort=[("name", 1)])) == ["a", "b", "d"]
+    assert names(find(people, {"deleted_at": {"$ne": None}})) == ["c"]
+    assert names(find(people, {"age": None}, sort=[("name", 1)])) == ["c", "d"]
+
+
+def test_comparisons_skip_null_and_missing(people):
+    assert names(find(people, {"age": {"$gt": 30}})) == ["b"]
+    assert names(find(people, {"age": {"$gte": 30, "$lt": 40}})) == ["a"]
+    assert names(find(people, {"age": {"$lte": 100}}, sort=[("name", 1)])) == ["a", "b"]
+
+
+def test_in_nin_exists(people):
+    assert names(find(people, {"name": {"$in": ["a", "d", "z"]}}, sort=[("name", 1)])) == ["a", "d"]
+    assert names(find(people, {"name": {"$nin": ["a", "b"]}}, sort=[("name", 1)])) == ["c", "d"]
+    assert names(find(people, {"age": {"$exists": False}})) == ["d"]
+    assert names(find(people, {"deleted_at": {"$exists": True}}, sort=[("name", 1)])) == ["b", "c"]
+
+
+def test_arrays_and_dotted_paths(people):
+    assert names(find(people, {"tags": "y"}, sort=[("name", 1)])) == ["a", "b"]
+    assert names(find(people, {"address.city": "Lahore"})) == ["b"]
+
+
+def test_logical_operators(people):
+    assert names(find(people, {"$or": [{"name": "a"}, {"age": 40}]}, sort=[("name", 1)])) == ["a", "b"]
+    assert names(find(people, {"$and": [{"tags": "y"}, {"age": {"$gt": 35}}]})) == ["b"]
+    assert names(find(people, {"$nor": [{"name": "a"}, {"name": "b"}]}, sort=[("name", 1)])) == ["c", "d"]
+
+
+def test_sort_skip_limit_projection(people):
+    docs = run(people.find({}, {"name": 1}).sort("name", -1).skip(1).limit(2).to_list(None))
+    assert docs == [{"_id": docs[0]["_id"], "name": "c"}, {"_id": docs[1]["_id"], "name": "b"}]
+
+
+def test_unknown_operator_is_an_error(people):
+    with pytest.raises(memory_db.OperationFailure):
+        find(people, {"age": {"$regex": "x"}})
+
+
+def test_update_operators(coll):
+    run(coll.insert_one({"_id": 1, "n": 5, "low": 10, "high": 10, "gone": True}))
+    run(coll.update_one({"_id": 1}, {
+        "$inc": {"n": 2, "counts.a": 1},
+        "$min": {"low": 3},
+        "$max": {"high": 3},
+        "$set": {"nested.field": "v"},
+        "$unset": {"gone": ""},
+    }))
+    doc = run(coll.find_one({"_id": 1}))
+    assert doc == {"_id": 1, "n": 7, "low": 3, "high": 10, "counts": {"a": 1}, "nested": {"field": "v"}}
+
+
+def test_update_many_counts(coll):
+    run(coll.insert_many([{"k": 1}, {"k": 1}, {"k": 2}]))
+    result = run(coll.update_many({"k": 1}, {"$set": {"seen": True}}))
+    assert (result.matched_count, result.modified_count) == (2, 2)
+
+
+def test_stored_documents_are_copies(coll):
+    doc = {"tags": ["a"]}
+    run(coll.insert_one(doc))
+    doc["tags"].append("b")
+    assert run(coll.find_one({}))["tags"] == ["a"]
+
+
+def test_aware_datetimes_are_stored_as_naive_utc(coll):
+    run(coll.insert_one({"at": datetime(2025, 1, 1, 5, tzinfo=timezone(timedelta(hours=5)))}))
+    assert run(coll.find_one({}))["at"] == datetime(2025, 1, 1)
+
+
+def test_find_one_and_update_upsert(coll):
+    before = run(coll.find_one_and_update(
+        {"key": "k"}, {"$inc": {"n": 1}, "$setOnInsert": {"created": True}}, upsert=True,
+    ))
+    assert before is None
+    after = run(coll.find_one_and_update(
+        {"key": "k"}, {"$inc": {"n": 1}, "$setOnInsert": {"created": False}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    ))
+    assert (after["key"], after["n"], after["created"]) == ("k", 2, True)
+    inserted = run(coll.find_one_and_update(
+        {"key": "other"}, {"$set": {"n": 9}}, upsert=True, return_document=ReturnDocument.AFTER,
+    ))
+    assert (inserted["key"], inserted["n"]) == ("other", 9)
+
+
+def test_unique_index(coll):
+    run(coll.create_index("email", unique=True))
+    run(coll.insert_one({"email": "a@x"}))
+    with pytest.raises(DuplicateKeyError):
+        run(coll.insert_one({"email": "a@x"}))
+    run(coll.insert_one({"email": "b@x"}))
+    with pytest.raises(DuplicateKeyError):
+        run(coll.update_one({"email": "b@x"}, {"$set": {"email": "a@x"}}))
+    run(coll.insert_many([{"email": "c@x", "dup": 1}, {"email": "d@x", "dup": 1}]))
+    with pytest.raises(DuplicateKeyError):
+        run(coll.create_index("dup", unique=True))
+
+
+def test_partial_unique_index_ignores_uncovered_documents(coll):
+    run(coll.create_index("username", unique=True, partialFilterExpression={"username": {"$gt": ""}}))
+    run(coll.insert_many([{"username": None}, {"username": None}, {"username": "u"}]))
+    with pytest.raises(DuplicateKeyError):
+        run(coll.insert_one({"username": "u"}))
+
+
+def test_insert_many_unordered_reports_each_failure(coll):
+    run(coll.create_index("k", unique=True))
+    with pytest.raises(BulkWriteError) as error:
+        run(coll.insert_many([{"k": 1}, {"k": 1}, {"k": 2}, {"k": 2}], ordered=False))
+    assert [e["index"] for e in error.value.details["writeErrors"]] == [1, 3]
+    assert sorted(doc["k"] for doc in find(coll)) == [1, 2]
+
+
+def test_upsert_into_existing_id_raises_duplicate(coll):
+    run(coll.insert_one({"_id": "lease", "holder": "a"}))
+    with pytest.raises(DuplicateKeyError):
+        run(coll.update_one({"_id": "lease", "holder": "b"}, {"$set": {"holder": "b"}}, upsert=True))
+
+
+def test_bulk_write(coll):
+    run(coll.bulk_write([
+        UpdateOne({"_id": 1}, {"$setOnInsert": {"v": 1}}, upsert=True),
+        UpdateOne({"_id": 1}, {"$setOnInsert": {"v": 2}}, upsert=True),
+    ]))
+    assert run(coll.find_one({"_id": 1}))["v"] == 1
+
+
+@pytest.fixture
+def ttl_now(monkeypatch):
+    monkeypatch.setattr(memory_db, "TTL_CHECK_SECONDS", 0)
+
+
+def test_ttl_index_expires_documents(coll, ttl_now):
+    now = datetime.utcnow()
+    run(coll.create_index("expires_at", expireAfterSeconds=0))
+    run(coll.insert_many([
+        {"name": "old", "expires_at": now - timedelta(seconds=1)},
+        {"name": "new", "expires_at": now + timedelta(hours=1)},
+        {"name": "never"},
+    ]))
+    assert sorted(names(find(coll))) == ["never", "new"]
+
+
+def test_ttl_uses_the_current_date_after_updates(coll, ttl_now):
+    now = datetime.utcnow()
+    run(coll.create_index("expires_at", expireAfterSeconds=0))
+    run(coll.insert_one({"_id": 1, "expires_at": now + timedelta(hours=1)}))
+    run(coll.update_one({"_id": 1}, {"$set": {"expires_at": now - timedelta(seconds=1)}}))
+    assert find(coll) == []
+
+    # Moved to a later date between two checks: the entry for the old
+    # date is still queued and must not take the document with it.
+    coll._next_ttl_check = float("inf")
+    run(coll.insert_one({"_id": 2, "expires_at": now - timedelta(seconds=1)}))
+    run(coll.update_one({"_id": 2}, {"$set": {"expires_at": now + timedelta(hours=1)}}))
+    coll._next_ttl_check = 0
+    assert [doc["_id"] for doc in find(coll)] == [2]
+
+
+def test_ttl_after_seconds(coll, ttl_now):
+    run(coll.create_index("created_at", expireAfterSeconds=60))
+    run(coll.insert_many([
+        {"name": "stale", "created_at": datetime.utcnow() - timedelta(seconds=61)},
+        {"name": "fresh", "created_at": datetime.utcnow()},
+    ]))
+    assert names(find(coll)) == ["fresh"]
+
+
+def test_rename_replaces_target_contents(coll):
+    db = coll.database
+    run(coll.insert_one({"old": True}))
+    staging = db["staging"]
+    run(staging.create_index("k", unique=True))
+    run(staging.insert_one({"k": 1}))
+    run(staging.rename("items", dropTarget=True))
+    assert [doc["k"] for doc in find(coll)] == [1]
+    assert find(staging) == []
+    with pytest.raises(DuplicateKeyError):
+        run(coll.insert_one({"k": 1}))
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+from src.periodic import Periodic
+
+from .conftest import run
+
+
+def test_calls_survive_failures_and_stop_cancels(caplog):
+    calls = []
+
+    async def fn():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    async def go():
+        periodic = Periodic("Test loop", 0.01, fn)
+        periodic.start()
+        await asyncio.sleep(0.1)
+        await periodic.stop()
+        stopped = len(calls)
+        await asyncio.sleep(0.05)
+        return stopped
+
+    with caplog.at_level(logging.ERROR):
+        stopped = run(go())
+    assert stopped >= 3 and len(calls) == stopped
+    assert "Test loop failed" in caplog.text
+
+
+def test_wake_and_immediately():
+    calls = []
+
+    async def fn():
+        calls.append(asyncio.get_running_loop().time())
+
+    async def go():
+        periodic = Periodic("Test loop", 60, fn)
+        periodic.start(immediately=True)
+        await asyncio.sleep(0.01)
+        assert len(calls) == 1
+        periodic.wake()
+        await asyncio.sleep(0.01)
+        assert len(calls) == 2
+        await periodic.stop()
+
+    run(go())
+
+
+def test_interval_may_be_computed():
+    delays = iter([0.01, 0.01, 60])
+    calls = []
+
+    async def fn():
+        calls.append(None)
+
+    async def go():
+        periodic = Periodic("Test loop", lambda: next(delays), fn)
+        periodic.start()
+        await asyncio.sleep(0.1)
+        await periodic.stop()
+
+    run(go())
+    assert len(calls) == 2